@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.render import percentile
+from network.protocol import Protocol, TYPE_ERROR, TYPE_HELLO, TYPE_STATUS
+from network.workers import LOOPS
+
+CLIENT_COUNTS = (100, 500, 1000, 2000)
+STATUS_IDLE = 0
+STATUS_VIDEO = 1
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+
+class LoadStats:
+    def __init__(self):
+        # press to confirmed start, and scheduled video end to received idle
+        self.start_latencies = []
+        self.end_latencies = []
+        self.presses = 0
+        self.received = 0
+        self.errors = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class SimulatedClient:
+    # Speaks the binary protocol like client.py, minus GPIO and LEDs: presses at random
+    # while idle and times how long the server takes to answer.
+    def __init__(self, host: str, port: int, stats: LoadStats, press_rate: float, video_length: float):
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.press_rate = press_rate
+        self.video_length = video_length
+        self.protocol = Protocol(True)
+        self.pressed_at = None
+        self.video_end = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def run(self, stop_at: float):
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.stats.error('connect')
+            return
+
+        writer.write(self.protocol.encode(TYPE_HELLO))
+        receiver = asyncio.create_task(self.receive(reader))
+        try:
+            while time.monotonic() < stop_at:
+                await self.idle.wait()
+                await asyncio.sleep(random.expovariate(self.press_rate))
+                if time.monotonic() >= stop_at or receiver.done():
+                    break
+                self.idle.clear()
+                self.pressed_at = time.time()
+                self.stats.presses += 1
+                writer.write(self.protocol.encode_status(STATUS_VIDEO))
+                await writer.drain()
+        except ConnectionError:
+            self.stats.error('reset')
+        finally:
+            # a video still running at the end is not counted as missing
+            await asyncio.sleep(0.1)
+            receiver.cancel()
+            writer.close()
+
+    async def receive(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                message = await self.protocol.read(reader)
+                if message is None:
+                    self.stats.error('disconnect')
+                    return
+
+                self.stats.received += 1
+                now = time.time()
+                if message.type == TYPE_ERROR:
+                    self.stats.error('server error')
+                elif message.type != TYPE_STATUS:
+                    continue
+                elif message.start_at is not None and self.pressed_at is not None:
+                    self.stats.start_latencies.append(now - self.pressed_at)
+                    self.video_end = message.start_at + self.video_length
+                    self.pressed_at = None
+                elif message.status == STATUS_IDLE and self.video_end is not None:
+                    self.stats.end_latencies.append(now - self.video_end)
+                    self.video_end = None
+                    self.idle.set()
+        except (ConnectionError, ValueError):
+            self.stats.error('reset')
+
+
+async def run_level(args, clients: int) -> dict:
+    stats = LoadStats()
+    started = time.monotonic()
+    stop_at = started + args.ramp + args.duration
+    simulated = [SimulatedClient(args.host, args.port, stats, args.press_rate, args.video_length)
+                 for _ in range(clients)]
+
+    tasks = []
+    for client in simulated:
+        tasks.append(asyncio.create_task(client.run(stop_at)))
+        # spreads the connects over the ramp, the server listens with a finite backlog
+        await asyncio.sleep(args.ramp / clients)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    missing = sum(1 for client in simulated if client.pressed_at is not None)
+    if missing:
+        stats.errors['no answer'] = missing
+
+    result = {
+        'clients': clients,
+        'presses': stats.presses,
+        'messages_per_s': stats.received / elapsed,
+        'errors': stats.errors,
+    }
+    for name, latencies in (('start', stats.start_latencies), ('end', stats.end_latencies)):
+        if latencies:
+            result.update({f'{name}_p50_ms': percentile(latencies, 50) * 1000,
+                           f'{name}_p99_ms': percentile(latencies, 99) * 1000,
+                           f'{name}_max_ms': max(latencies) * 1000})
+    return result
+
+
+def print_result(result: dict):
+    line = f"{result['clients']:>6} clients {result['presses']:>7} presses {result['messages_per_s']:>9.1f} msg/s"
+    for name in ('start', 'end'):
+        if f'{name}_p50_ms' in result:
+            line += (f"  {name} p50 {result[f'{name}_p50_ms']:>7.2f} ms p99 {result[f'{name}_p99_ms']:>7.2f} ms "
+                     f"max {result[f'{name}_max_ms']:>7.2f} ms")
+    errors = sum(result['errors'].values())
+    print(line + f"  errors {errors}" + (f" {result['errors']}" if errors else ''))
+
+
+def start_server(directory: str, args, workers: int = 1) -> subprocess.Popen:
+    with open(os.path.join(directory, 'server.ini'), 'w') as config:
+        config.write(f'[server]\nhost = {args.host}\nport = {args.port}\nvideo_length = {args.video_length}\n'
+                     f'queue_size = 16\n')
+    command = [sys.executable, SERVER, '--workers', str(workers)]
+    if args.loop:
+        command += ['--loop', args.loop]
+    server = subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL)
+    time.sleep(1 + workers * 0.5)
+    if server.poll() is not None:
+        raise RuntimeError('Server did not start')
+    return server
+
+
+async def run_levels(args) -> list:
+    results = []
+    for clients in args.clients:
+        results.append(await run_level(args, clients))
+        print_result(results[-1])
+        # lets the server drop the closed sessions before the next level
+        await asyncio.sleep(1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test server.py with simulated heart clients')
+    parser.add_argument('--clients', type=int, nargs='+', default=CLIENT_COUNTS, help='concurrency levels to test')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per level after the ramp')
+    parser.add_argument('--ramp', type=float, default=2, help='seconds over which the clients connect')
+    parser.add_argument('--press-rate', type=float, default=1, help='presses per second of an idle client')
+    parser.add_argument('--video-length', type=float, default=1, help='video length of the started server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18990)
+    parser.add_argument('--loop', choices=LOOPS, help='event loop of the started server')
+    parser.add_argument('--external', action='store_true',
+                        help='load a server that is already running instead of starting one')
+    parser.add_argument('--save', help='write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None if args.external else start_server(directory, args)
+        try:
+            results = asyncio.run(run_levels(args))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+        print(f'Results saved to {args.save}')
+
+
+if __name__ == '__main__':
+    main()
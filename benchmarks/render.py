@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from driver.backend import DRIVER_SIMULATED
+from led_strip.queue import LEDStripQueue
+
+STRIP_COUNTS = (1, 2, 4)
+LED_COUNTS = (60, 300, 1000)
+# GPIO pins on separate PWM channels, reused when there are more strips than pins
+PINS = (18, 13, 12, 19)
+
+
+def write_led_config(path: str, strips: int, count: int):
+    with open(path, 'w') as config:
+        for i in range(strips):
+            config.write(f'[strip_{i}]\ncount = {count}\npin = {PINS[i % len(PINS)]}\ndriver = {DRIVER_SIMULATED}\n\n')
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class StepClock:
+    # stands in for the server clock the video is positioned by, it moves on by the frame step
+    now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def run_case(led_config: str, status: int, frames: int, warmup: int, fps: float, repeat: int) -> dict:
+    # frames are pushed inside show(), an output thread would leave only the hand-off to time
+    queue = LEDStripQueue(led_config, fps=fps, driver=DRIVER_SIMULATED, threaded_output=False)
+    queue.init()
+    try:
+        return await measure(queue, status, frames, warmup, fps, repeat)
+    finally:
+        queue.close()
+
+
+async def measure(queue: LEDStripQueue, status: int, frames: int, warmup: int, fps: float, repeat: int) -> dict:
+    state = queue.led_state
+    # a fixed step per frame keeps the animation, and therefore the work per frame, repeatable
+    elapsed = 1 / fps
+    clock = StepClock()
+    state.clock = clock
+    await queue.run(status)
+
+    for _ in range(warmup):
+        clock.now += elapsed
+        await state.show(elapsed)
+
+    # the fastest of several rounds is the least disturbed by other load on the machine
+    rounds = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            frame_times = []
+            for _ in range(frames):
+                clock.now += elapsed
+                start = time.perf_counter()
+                await state.show(elapsed)
+                frame_times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        rounds.append(frame_times)
+    frame_times = min(rounds, key=lambda times: percentile(times, 50))
+
+    tracemalloc.start()
+    try:
+        allocated = []
+        for _ in range(min(frames, 100)):
+            tracemalloc.reset_peak()
+            clock.now += elapsed
+            before = tracemalloc.get_traced_memory()[0]
+            await state.show(elapsed)
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    shows = sum(strip.strip.shows for strip in state.strips.values())
+    return {
+        'fps': len(frame_times) / sum(frame_times),
+        'p50_ms': percentile(frame_times, 50) * 1000,
+        'p99_ms': percentile(frame_times, 99) * 1000,
+        'alloc_bytes': statistics.mean(allocated),
+        'shows': shows,
+    }
+
+
+async def run_matrix(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        led_config = os.path.join(directory, 'led.ini')
+        for strips in args.strips:
+            for count in args.counts:
+                write_led_config(led_config, strips, count)
+                for status, name in LEDStripQueue.STATUSES.items():
+                    key = f'{name}/{strips}x{count}'
+                    results[key] = await run_case(led_config, status, args.frames, args.warmup, args.fps,
+                                                  args.repeat)
+                    print_result(key, results[key])
+    return results
+
+
+def print_result(key: str, result: dict, baseline: dict = None):
+    line = (f"{key:<16} {result['fps']:>10.1f} fps  p50 {result['p50_ms']:>7.3f} ms  "
+            f"p99 {result['p99_ms']:>7.3f} ms  alloc {result['alloc_bytes']:>9.0f} B/frame")
+    if baseline is not None:
+        line += f"  p50 {(result['p50_ms'] / baseline['p50_ms'] - 1) * 100:+.1f}%"
+    print(line)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print(f'\nCompared to baseline (tolerance {tolerance * 100:.0f}%):')
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        print_result(key, result, baseline[key])
+        if result['p50_ms'] > baseline[key]['p50_ms'] * (1 + tolerance):
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render benchmark for LEDStripQueue and LedStripState')
+    parser.add_argument('--strips', type=int, nargs='+', default=STRIP_COUNTS, help='strip counts to test')
+    parser.add_argument('--counts', type=int, nargs='+', default=LED_COUNTS, help='LEDs per strip to test')
+    parser.add_argument('--frames', type=int, default=500, help='measured frames per case')
+    parser.add_argument('--repeat', type=int, default=5, help='measured rounds per case, the fastest is kept')
+    parser.add_argument('--warmup', type=int, default=50, help='frames rendered before measuring')
+    parser.add_argument('--fps', type=float, default=60, help='frame rate the animations are stepped at')
+    parser.add_argument('--save', help='write results to this baseline file')
+    parser.add_argument('--compare', help='compare results against this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed p50 slowdown against the baseline')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_matrix(args))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f'Baseline saved to {args.save}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'Render regressions: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
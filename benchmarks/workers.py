@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import run_level, start_server
+from network.workers import LOOPS
+
+WORKER_COUNTS = (1, 2, 4)
+
+
+def generate_load(args, clients: int) -> dict:
+    return asyncio.run(run_level(args, clients))
+
+
+def merge(results: list) -> dict:
+    # percentiles of separate generators cannot be merged exactly, the worst p99 is kept
+    merged = {
+        'presses': sum(result['presses'] for result in results),
+        'messages_per_s': sum(result['messages_per_s'] for result in results),
+        'errors': sum(sum(result['errors'].values()) for result in results),
+    }
+    for name in ('start', 'end'):
+        p50 = [result[f'{name}_p50_ms'] for result in results if f'{name}_p50_ms' in result]
+        if p50:
+            merged[f'{name}_p50_ms'] = statistics.mean(p50)
+            merged[f'{name}_p99_ms'] = max(result[f'{name}_p99_ms'] for result in results if f'{name}_p99_ms' in result)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server throughput by number of SO_REUSEPORT workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKER_COUNTS, help='worker counts to test')
+    parser.add_argument('--clients', type=int, default=2000, help='simulated clients per run')
+    parser.add_argument('--generators', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='load generator processes, one alone saturates before the server does')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run after the ramp')
+    parser.add_argument('--ramp', type=float, default=2, help='seconds over which the clients connect')
+    parser.add_argument('--press-rate', type=float, default=5, help='presses per second of an idle client')
+    parser.add_argument('--video-length', type=float, default=0.2, help='video length of the started server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18990)
+    parser.add_argument('--loop', choices=LOOPS, help='event loop of the started server')
+    parser.add_argument('--save', help='write results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as directory:
+            server = start_server(directory, args, workers)
+            try:
+                with context.Pool(args.generators) as pool:
+                    share = args.clients // args.generators
+                    runs = pool.starmap(generate_load, [(args, share)] * args.generators)
+            finally:
+                server.terminate()
+                server.wait()
+        # the port is free again for the next run
+        time.sleep(1)
+
+        result = results[workers] = merge(runs)
+        presses = result['presses'] / (args.ramp + args.duration)
+        scaling = presses / (results[args.workers[0]]['presses'] / (args.ramp + args.duration))
+        line = f"{workers:>3} workers {presses:>9.1f} presses/s {result['messages_per_s']:>9.1f} msg/s  x{scaling:.2f}"
+        if 'start_p50_ms' in result:
+            line += f"  start p50 {result['start_p50_ms']:>7.2f} ms p99 {result['start_p99_ms']:>8.2f} ms"
+        print(line + f"  errors {result['errors']}")
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+        print(f'Results saved to {args.save}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from typing import Union
+
+
+class ButtonEvent:
+    pressed: bool = False
+    # monotonic time of the first edge of the bounce, used for latency reporting
+    timestamp: float = 0.0
+
+    def __init__(self, pressed: bool, timestamp: float):
+        self.pressed = pressed
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f'ButtonEvent(pressed={self.pressed}, timestamp={self.timestamp:.3f})'
+
+
+class ButtonInput:
+    gpio = None
+    pin: int = 0
+    debounce_ms: float = 50
+
+    pressed: bool = False
+    events: asyncio.Queue = None
+
+    loop: asyncio.AbstractEventLoop = None
+    edge_time: Union[float, None] = None
+    settle_handle: Union[asyncio.TimerHandle, None] = None
+
+    def __init__(self, gpio, pin: int, events: asyncio.Queue, debounce_ms: float = 50):
+        if pin < 1:
+            raise AttributeError('Button pin cannot be null')
+
+        self.gpio = gpio
+        self.pin = pin
+        self.events = events
+        self.debounce_ms = debounce_ms
+
+    def read(self) -> bool:
+        # the button pulls the pin low while pressed
+        return self.gpio.input(self.pin) < 1
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+
+        self.gpio.setup(self.pin, self.gpio.IN)
+        self.pressed = self.read()
+        self.events.put_nowait(ButtonEvent(self.pressed, time.monotonic()))
+
+        self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=self.on_edge)
+
+    def stop(self):
+        self.gpio.remove_event_detect(self.pin)
+        if self.settle_handle is not None:
+            self.settle_handle.cancel()
+            self.settle_handle = None
+
+    def on_edge(self, channel):
+        # called from the RPi.GPIO event thread
+        self.loop.call_soon_threadsafe(self.edge, time.monotonic())
+
+    def edge(self, timestamp: float):
+        if self.edge_time is None:
+            self.edge_time = timestamp
+
+        # every edge restarts the debounce window, the level is read once it settles
+        if self.settle_handle is not None:
+            self.settle_handle.cancel()
+        self.settle_handle = self.loop.call_later(self.debounce_ms / 1000.0, self.settle)
+
+    def settle(self):
+        self.settle_handle = None
+        pressed = self.read()
+        if pressed != self.pressed:
+            self.pressed = pressed
+            self.events.put_nowait(ButtonEvent(pressed, self.edge_time))
+        self.edge_time = None
@@ -1,26 +1,97 @@
 #!/usr/bin/env python3
 
+# imported first, so the startup timer covers the imports below
+from service.startup import notify, startup
+
 import os
+import argparse
 import asyncio
+import collections
+import time
 from configparser import ConfigParser
+from typing import Union
 
-import RPi.GPIO as IO
-
+from button import ButtonEvent, ButtonInput
+from driver.backend import DRIVER_WS281X, get_gpio
 from led_strip.queue import LEDStripQueue
+from network.clock import ClockSync, PONG
+from network.protocol import PROTOCOL_BINARY, PROTOCOL_TEXT, Protocol, TYPE_DELTA, TYPE_ERROR, TYPE_HELLO, \
+    TYPE_KEYFRAME, TYPE_PING, TYPE_PONG, TYPE_SYNC
+from service.trace import install_dump_handlers, traced, tracer
+
+# multicast, streaming, metrics and the config watcher are imported when they start,
+# after the first frame is lit
+startup.mark('imports')
 
 
 class Client:
     config = ConfigParser()
+    server_config: str = None
     led_config: ConfigParser = None
     led_queue: LEDStripQueue = None
 
     host: str = None
     port: int = None
+    protocol: Protocol = None
 
     connection_writer: asyncio.StreamWriter = None
     connection_reader: asyncio.StreamReader = None
 
     button_pin = 0
+    button_debounce_ms: float = 50
+    button: ButtonInput = None
+    button_pressed: bool = False
+    # button edges and server messages, each one runs the status state machine once
+    events: asyncio.Queue = None
+
+    # press to first light latency in seconds
+    press_time: Union[float, None] = None
+    latencies: collections.deque = None
+
+    fps: float = 60
+    driver: str = DRIVER_WS281X
+    threaded_output: bool = True
+    parallel_output: bool = True
+    animation_cache_mb: float = 8
+    # lowers the frame rate to what the strips and CPU keep up with
+    adaptive_pacing: bool = False
+    # lowest rate pacing picks, share of a frame the frame work may take, frames per measurement
+    pacing_min_fps: float = 15
+    pacing_headroom: float = 0.7
+    pacing_window: int = 120
+    # crossfade between animations on status changes
+    transition_ms: float = 250
+    # pre-rendered light show file played during the video
+    show_file: str = None
+    # network.stream.FrameDecoder of live frames streamed by the server, binary protocol only
+    stream_decoder = None
+    # offset to the server clock, animations start at server times
+    clock: ClockSync = None
+    clock_interval: float = 10
+    # group:port the server multicasts status broadcasts to
+    multicast_address: str = None
+    # network.multicast.MulticastReceiver
+    multicast_receiver = None
+    gpio = None
+
+    reload_interval: float = 2
+    # service.config.ConfigWatcher
+    watcher = None
+    # set when the server settings change and the connection has to be opened again
+    reconnect: asyncio.Event = None
+    # set once the strips run, server messages wait for it while the connection opens in parallel
+    lights_on: asyncio.Event = None
+
+    # host:port or unix:/path for the Prometheus metrics endpoint
+    metrics_address: str = None
+    # service.metrics.Registry
+    metrics_registry = None
+    latency_seconds = None
+    transitions = None
+
+    # Chrome trace output file, tracing stays off without it
+    trace_path: str = None
+    trace_size: int = 100000
 
     status: int = -1
     server_started: bool = False
@@ -53,35 +124,237 @@ class Client:
             if hasattr(self, field):
                 setattr(self, field, self.config['server'][field])
 
+        protocol = self.config['server'].get('protocol', PROTOCOL_BINARY)
+        if protocol not in [PROTOCOL_BINARY, PROTOCOL_TEXT]:
+            raise AttributeError(f'Unknown protocol "{protocol}"')
+        self.protocol = Protocol(protocol == PROTOCOL_BINARY)
+
         if 'button' not in self.config.sections() or 'pin' not in self.config['button']:
             raise AttributeError('Button pin cannot be null')
 
         if 'service' in self.config.sections() and 'debug' in self.config['service']:
             self.led_debug = True if int(self.config['service']['debug']) > 0 else False
 
+        if 'service' in self.config.sections() and 'fps' in self.config['service']:
+            self.fps = float(self.config['service']['fps'])
+
+        if 'service' in self.config.sections() and 'driver' in self.config['service']:
+            self.driver = self.config['service']['driver']
+
+        if 'service' in self.config.sections() and 'output' in self.config['service']:
+            if self.config['service']['output'] not in ['thread', 'sync']:
+                raise AttributeError('Service output must be "thread" or "sync"')
+            self.threaded_output = self.config['service']['output'] == 'thread'
+
+        if 'service' in self.config.sections() and 'parallel_output' in self.config['service']:
+            self.parallel_output = True if int(self.config['service']['parallel_output']) > 0 else False
+
+        if 'service' in self.config.sections() and 'pacing' in self.config['service']:
+            if self.config['service']['pacing'] not in ['adaptive', 'fixed']:
+                raise AttributeError('Service pacing must be "adaptive" or "fixed"')
+            self.adaptive_pacing = self.config['service']['pacing'] == 'adaptive'
+            self.pacing_min_fps = float(self.config['service'].get('pacing_min_fps', self.pacing_min_fps))
+            self.pacing_headroom = float(self.config['service'].get('pacing_headroom', self.pacing_headroom))
+            self.pacing_window = int(self.config['service'].get('pacing_window', self.pacing_window))
+
+        if 'service' in self.config.sections() and 'animation_cache_mb' in self.config['service']:
+            self.animation_cache_mb = float(self.config['service']['animation_cache_mb'])
+
+        if 'service' in self.config.sections() and 'transition_ms' in self.config['service']:
+            self.transition_ms = float(self.config['service']['transition_ms'])
+
+        if 'service' in self.config.sections() and 'show' in self.config['service']:
+            self.show_file = self.config['service']['show']
+
+        if 'service' in self.config.sections() and int(self.config['service'].get('stream', 0)) > 0:
+            from network.stream import FrameDecoder
+            self.stream_decoder = FrameDecoder()
+
+        if 'service' in self.config.sections() and 'multicast' in self.config['service']:
+            self.multicast_address = self.config['service']['multicast']
+
+        if 'service' in self.config.sections() and 'clock_interval' in self.config['service']:
+            self.clock_interval = float(self.config['service']['clock_interval'])
+
+        if 'service' in self.config.sections() and 'metrics' in self.config['service']:
+            self.metrics_address = self.config['service']['metrics']
+
+        if 'service' in self.config.sections() and 'trace' in self.config['service']:
+            self.trace_path = self.config['service']['trace']
+            self.trace_size = int(self.config['service'].get('trace_size', self.trace_size))
+
+        if 'service' in self.config.sections() and 'reload_interval' in self.config['service']:
+            self.reload_interval = float(self.config['service']['reload_interval'])
+
         if 'debug' in self.config['server']:
             self.debug = True if int(self.config['server']['debug']) > 0 else False
 
         self.button_pin = int(self.config['button']['pin'])
-        IO.setup(self.button_pin, IO.IN)
+        if 'debounce_ms' in self.config['button']:
+            self.button_debounce_ms = float(self.config['button']['debounce_ms'])
+        self.latencies = collections.deque(maxlen=100)
+        self.clock = ClockSync()
 
+        self.server_config = server_config
         self.led_config = led_config
         self.status = LEDStripQueue.STATUS_IDLE
 
+    async def reload_server_config(self, sections: set):
+        config = ConfigParser()
+        config.read(self.server_config)
+
+        if 'service' in sections and 'service' in config.sections():
+            service = config['service']
+            self.led_debug = True if int(service.get('debug', 0)) > 0 else False
+            self.led_queue.debug = self.led_debug
+            self.clock_interval = float(service.get('clock_interval', self.clock_interval))
+            self.transition_ms = float(service.get('transition_ms', self.transition_ms))
+            self.led_queue.led_state.transition_seconds = self.transition_ms / 1000
+            self.pacing_min_fps = float(service.get('pacing_min_fps', self.pacing_min_fps))
+            self.pacing_headroom = float(service.get('pacing_headroom', self.pacing_headroom))
+            self.pacing_window = int(service.get('pacing_window', self.pacing_window))
+            if self.led_queue.pacer is not None:
+                self.led_queue.pacer.configure(self.pacing_min_fps, self.pacing_headroom, self.pacing_window)
+            fps = float(service.get('fps', self.fps))
+            if fps != self.fps:
+                self.fps = fps
+                self.led_queue.set_fps(fps)
+                # the compiled animation periods depend on the frame rate
+                if self.led_queue.active_animation is not None:
+                    await self.led_queue.active_animation()
+            for field in ['driver', 'output', 'parallel_output', 'pacing', 'animation_cache_mb', 'show', 'stream',
+                          'multicast']:
+                if service.get(field) != (self.config['service'].get(field) if 'service' in self.config else None):
+                    print(f'Config: [service] {field} changes on the next restart')
+
+        if 'button' in sections and 'button' in config.sections() and 'pin' in config['button']:
+            pin = int(config['button']['pin'])
+            debounce_ms = float(config['button'].get('debounce_ms', self.button_debounce_ms))
+            if pin != self.button_pin or debounce_ms != self.button_debounce_ms:
+                self.button.stop()
+                self.button_pin = pin
+                self.button_debounce_ms = debounce_ms
+                self.button = ButtonInput(self.gpio, pin, self.events, debounce_ms)
+                self.button.start()
+
+        if 'server' in sections and 'server' in config.sections():
+            server = config['server']
+            self.debug = True if int(server.get('debug', 0)) > 0 else False
+            protocol = server.get('protocol', PROTOCOL_BINARY)
+            if (server.get('host'), server.get('port'), protocol == PROTOCOL_BINARY) != \
+                    (self.host, self.port, self.protocol.binary):
+                self.host = server.get('host')
+                self.port = server.get('port')
+                self.protocol = Protocol(protocol == PROTOCOL_BINARY)
+                self.reconnect.set()
+
+        self.config = config
+        if self.debug:
+            print(f'Config: Reloaded {self.server_config} sections {sorted(sections)}')
+
+    async def start_metrics(self):
+        from service.metrics import MetricsServer, Registry
+
+        self.metrics_registry = Registry()
+        metrics = self.metrics_registry
+        self.led_queue.instrument(metrics)
+        self.latency_seconds = metrics.histogram('heart_button_to_light_seconds',
+                                                 'Time from a button press to the first pushed frame')
+        self.transitions = metrics.counter('heart_status_transitions_total', 'Status changes by new status')
+        metrics.gauge('heart_server_connected', 'Connection to the server is open',
+                      lambda: 1 if self.server_connected else 0)
+        if self.multicast_receiver is not None:
+            metrics.counter('heart_multicast_packets_total', 'Multicast packets by outcome',
+                            lambda: {(('outcome', outcome),): value
+                                     for outcome, value in self.multicast_receiver.stats().items()})
+        if self.stream_decoder is not None:
+            metrics.counter('heart_stream_frames_received_total', 'Streamed frames applied to the strips',
+                            lambda: self.stream_decoder.received)
+            metrics.counter('heart_stream_frames_dropped_total', 'Streamed frames dropped until the next keyframe',
+                            lambda: self.stream_decoder.dropped)
+        metrics.gauge('heart_clock_offset_seconds', 'Server clock minus local clock',
+                      lambda: self.clock.offset)
+        metrics.gauge('heart_clock_rtt_seconds', 'Round trip time of the best clock sample',
+                      lambda: self.clock.rtt or 0)
+
+        metrics_server = MetricsServer(metrics, self.metrics_address)
+        await metrics_server.start()
+        if self.debug:
+            print(f'Metrics on {self.metrics_address}')
+        return metrics_server
+
+    async def server_connection(self):
+        # keeps one connection attempt running and starts over when the server settings change
+        while True:
+            self.reconnect.clear()
+            connect_task = asyncio.create_task(self.connect_to_server())
+            reconnect_task = asyncio.create_task(self.reconnect.wait())
+            try:
+                await asyncio.wait([connect_task, reconnect_task], return_when=asyncio.FIRST_COMPLETED)
+
+                if not self.reconnect.is_set():
+                    await reconnect_task
+            finally:
+                # also when this task is cancelled, no attempt outlives it
+                reconnect_task.cancel()
+                connect_task.cancel()
+
+            if self.server_connected:
+                self.connection_writer.close()
+                self.server_connected = False
+                self.server_started = False
+                self.wake()
+
     async def show_led(self):
-        try:
-            while True:
-                await self.led_queue.run(self.status)
-                await asyncio.sleep(0)
-        finally:
-            await self.led_queue.clear()
-            await asyncio.sleep(0)
+        while True:
+            # paced by the frame scheduler, sleeps until the next frame deadline
+            pushed = await self.led_queue.show()
+            if pushed and self.press_time is not None:
+                self.report_latency(time.monotonic() - self.press_time)
+                self.press_time = None
+
+    def report_latency(self, latency: float):
+        self.latencies.append(latency)
+        if self.latency_seconds is not None:
+            self.latency_seconds.observe(latency)
+        if self.debug:
+            average = sum(self.latencies) / len(self.latencies)
+            print(f'BUTTON: Press to light {latency * 1000:.1f} ms, '
+                  f'average {average * 1000:.1f} ms, max {max(self.latencies) * 1000:.1f} ms')
+
+    async def sync_clock(self):
+        # a quick burst of pings after connecting, then one per interval follows the drift
+        while True:
+            if self.server_connected and self.protocol.binary:
+                self.connection_writer.write(self.protocol.encode(TYPE_PING, self.clock.ping()))
+            await asyncio.sleep(self.clock_interval if len(self.clock.samples) >= 4 else 0.2)
+
+    def handle_multicast(self, message):
+        # broadcasts only mean something to a client the server knows about
+        if self.server_connected:
+            with tracer.span('Client.handle_multicast'):
+                self.handle_message(message)
+
+    def request_sync(self):
+        if self.server_connected and self.protocol.binary:
+            if self.debug:
+                print(f'SERVER: Missed multicast packets, {self.multicast_receiver.stats()}')
+            self.connection_writer.write(self.protocol.encode(TYPE_SYNC))
+
+    def wake(self):
+        if self.events is not None:
+            self.events.put_nowait(None)
 
     async def connect_to_server(self):
         try:
             self.connection_reader, self.connection_writer = await asyncio.open_connection(self.host, self.port)
             self.server_connected = True
-            if self.debug:
+            self.wake()
+            notify(f'STATUS=Connected to {self.host}:{self.port}')
+            if startup.connected is None:
+                startup.connected = startup.elapsed()
+                print(f'Startup: Connected to {self.host}:{self.port} {startup.connected * 1000:.1f} ms after start')
+            elif self.debug:
                 print(f'Connected to {self.host}:{self.port}')
         except ConnectionRefusedError as e:
             print(f'Connection not established with status {e}')
@@ -90,41 +363,104 @@ class Client:
             print(f'Connection not established with status {e}')
             return
 
+        if self.protocol.binary:
+            self.clock.reset()
+            if self.stream_decoder is not None:
+                self.stream_decoder.reset()
+            features = [b'stream'] if self.stream_decoder is not None else []
+            if self.multicast_address:
+                features.append(b'multicast')
+            self.connection_writer.write(self.protocol.encode(TYPE_HELLO, b','.join(features)))
+
+        await self.lights_on.wait()
         while True:
-            data = await self.connection_reader.read(100)
             try:
-                status = int(data.decode().strip())
+                message = await self.protocol.read(self.connection_reader)
             except ValueError:
-                self.connection_writer.write('Invalid int argument\n'.encode())
-                continue
-            except Exception as e:
-                self.connection_writer.write(f'Invalid status {e}\n'.encode())
-                continue
+                # a broken frame from the server, the next header cannot be found, so reconnect
+                self.connection_writer.write(self.protocol.encode_error('Invalid frame'))
+                message = None
+
+            with tracer.span('Client.connect_to_server'):
+                if not self.handle_message(message):
+                    return
+
+    def handle_message(self, message) -> bool:
+        if message is None:
+            print(f'Disconnected from {self.host}:{self.port}')
+            notify(f'STATUS=Disconnected from {self.host}:{self.port}')
+            self.server_connected = False
+            self.server_started = False
+            self.connection_writer.close()
+            self.wake()
+            return False
+
+        if message.type in (TYPE_KEYFRAME, TYPE_DELTA):
+            if self.stream_decoder is not None:
+                self.stream_decoder.apply(message.type, message.payload, self.led_queue.led_state.strips)
+            return True
+
+        if message.type == TYPE_PONG:
+            if len(message.payload) == PONG.size:
+                self.clock.pong(message.payload)
+                if self.debug:
+                    print(f'SERVER: Clock offset {self.clock.offset * 1000:.1f} ms, rtt {self.clock.rtt * 1000:.1f} ms')
+            return True
 
-            if status not in LEDStripQueue.STATUSES.keys():
-                self.connection_writer.write(f'Invalid status number!'.encode())
-                continue
+        if message.type == TYPE_ERROR:
+            if self.debug:
+                print(f'SERVER: Error {message.payload.decode(errors="replace")}')
+            return True
 
-            if status == LEDStripQueue.STATUS_IDLE:
-                if self.server_connected:
-                    if self.debug:
-                        print('SERVER: Stop video')
-                    self.server_started = False
-                else:
-                    if self.debug:
-                        print('LOCAL: Stop video')
-                    self.status = status
+        try:
+            status = message.status
+        except ValueError as e:
+            self.connection_writer.write(self.protocol.encode_error(f'Invalid status {e}'))
+            return True
+
+        if status not in LEDStripQueue.STATUSES.keys():
+            self.connection_writer.write(self.protocol.encode_error('Invalid status number!'))
+            return True
+
+        if message.start_at is not None and status == self.status:
+            # the server confirmed the video this client started, only its start time is new
+            self.led_queue.sync_start(message.start_at)
+            return True
+
+        if message.start_at is not None and status == LEDStripQueue.STATUS_VIDEO:
+            # another heart started the video, this one joins at the same moment
+            if self.debug:
+                print(f'SERVER: Join video at {message.start_at:.3f}')
+            self.server_started = True
+            self.led_cleared = False
+            self.status = status
+            self.status_changed = True
+            self.led_queue.sync_start(message.start_at)
+            self.wake()
+            return True
+
+        if status == LEDStripQueue.STATUS_IDLE:
+            if self.server_connected:
+                if self.debug:
+                    print('SERVER: Stop video')
+                self.server_started = False
             else:
                 if self.debug:
-                    print(f'SERVER: Set status {status}')
+                    print('LOCAL: Stop video')
                 self.status = status
+        else:
+            if self.debug:
+                print(f'SERVER: Set status {status}')
+            self.status = status
+
+        self.wake()
 
-            await asyncio.sleep(0)
+        return True
 
     async def send_status_to_server(self):
         if self.connection_writer is not None and self.server_connected:
             try:
-                self.connection_writer.write(str(self.status).encode())
+                self.connection_writer.write(self.protocol.encode_status(self.status))
                 if self.debug:
                     print('SERVER: Send start to server')
             except Exception as e:
@@ -133,102 +469,199 @@ class Client:
 
     async def get_status(self):
         while True:
-            # button pressed
-            if (IO.input(self.button_pin) < 1):
-                if self.server_connected:
-                    if not self.server_started and self.status == LEDStripQueue.STATUS_IDLE and self.led_cleared:
-                        if self.debug:
-                            print('SERVER: Start video')
-                        self.server_started = True
-                        self.led_cleared = False
-                        await self.led_queue.clear()
-                        self.status = LEDStripQueue.STATUS_VIDEO
-                        self.status_changed = True
-                        await self.send_status_to_server()
-                    elif not self.server_started and not self.led_cleared:
-                        if self.debug:
-                            print('SERVER: Stop video')
-                        if self.status != LEDStripQueue.STATUS_IDLE:
-                            await self.led_queue.clear()
-                            self.status_changed = True
-                        self.status = LEDStripQueue.STATUS_IDLE
-                    elif not self.system_started:
-                        self.system_started = True
-                        self.status = LEDStripQueue.STATUS_IDLE
+            event = await self.events.get()
+            if isinstance(event, ButtonEvent):
+                self.button_pressed = event.pressed
 
+            if await self.update_status() and isinstance(event, ButtonEvent) and event.pressed:
+                self.press_time = event.timestamp
 
-                else:
+    @traced('Client.get_status')
+    async def update_status(self) -> bool:
+        # button pressed
+        if self.button_pressed:
+            if self.server_connected:
+                if not self.server_started and self.status == LEDStripQueue.STATUS_IDLE and self.led_cleared:
                     if self.debug:
-                        print('LOCAL: Start video')
-                    if self.status == LEDStripQueue.STATUS_IDLE:
-                        await self.led_queue.clear()
+                        print('SERVER: Start video')
+                    self.server_started = True
+                    self.led_cleared = False
+                    await self.led_queue.clear()
                     self.status = LEDStripQueue.STATUS_VIDEO
-                    if not self.button_state:
+                    self.status_changed = True
+                    await self.send_status_to_server()
+                elif not self.server_started and not self.led_cleared:
+                    if self.debug:
+                        print('SERVER: Stop video')
+                    if self.status != LEDStripQueue.STATUS_IDLE:
+                        await self.led_queue.clear()
                         self.status_changed = True
-                        self.button_state = True
+                    self.status = LEDStripQueue.STATUS_IDLE
+                elif not self.system_started:
+                    self.system_started = True
+                    self.status = LEDStripQueue.STATUS_IDLE
+
 
             else:
-                if self.server_connected:
-                    if self.status != LEDStripQueue.STATUS_IDLE:
-                        if not self.server_started:
-                            if self.debug:
-                                print('SERVER: Start idle')
-                            await self.led_queue.clear()
-                            self.status = LEDStripQueue.STATUS_IDLE
-                            self.status_changed = True
-                            self.led_cleared = True
-                    else:
+                if self.debug:
+                    print('LOCAL: Start video')
+                if self.status == LEDStripQueue.STATUS_IDLE:
+                    await self.led_queue.clear()
+                self.status = LEDStripQueue.STATUS_VIDEO
+                if not self.button_state:
+                    self.status_changed = True
+                    self.button_state = True
+
+        else:
+            if self.server_connected:
+                if self.status != LEDStripQueue.STATUS_IDLE:
+                    if not self.server_started:
                         if self.debug:
-                            print('SERVER: reload')
+                            print('SERVER: Start idle')
+                        await self.led_queue.clear()
+                        self.status = LEDStripQueue.STATUS_IDLE
+                        self.status_changed = True
                         self.led_cleared = True
-
                 else:
                     if self.debug:
-                        print('LOCAL: reload')
-                    if self.status != LEDStripQueue.STATUS_IDLE:
-                        await self.led_queue.clear()
-                    self.status = LEDStripQueue.STATUS_IDLE
-                    if self.button_state:
-                        self.status_changed = True
-                        self.button_state = False
-
-            if self.status_changed:
-                await self.led_queue.clear()
-                await self.led_queue.run(self.status)
-                self.status_changed = False
+                        print('SERVER: reload')
+                    self.led_cleared = True
 
-            await self.led_queue.show()
-            await asyncio.sleep(0)
+            else:
+                if self.debug:
+                    print('LOCAL: reload')
+                if self.status != LEDStripQueue.STATUS_IDLE:
+                    await self.led_queue.clear()
+                self.status = LEDStripQueue.STATUS_IDLE
+                if self.button_state:
+                    self.status_changed = True
+                    self.button_state = False
+
+        if self.status_changed:
+            if self.transitions is not None:
+                self.transitions.inc(status=LEDStripQueue.STATUSES[self.status])
+            await self.led_queue.clear()
+            await self.led_queue.run(self.status)
+            self.status_changed = False
+            return True
+
+        return False
+
+    def start_leds(self) -> LEDStripQueue:
+        # runs in a thread, the event loop opens the server connection meanwhile
+        led_queue = LEDStripQueue(self.led_config, self.led_debug, self.fps, self.driver,
+                                  self.threaded_output, self.parallel_output, self.animation_cache_mb,
+                                  self.show_file, self.transition_ms, self.adaptive_pacing,
+                                  self.pacing_min_fps, self.pacing_headroom, self.pacing_window)
+        led_queue.led_state.stream = self.stream_decoder
+        led_queue.led_state.clock = self.clock.now
+        led_queue.init()
+        # known as soon as the output runs, a Ctrl-C during startup still clears the strips
+        self.led_queue = led_queue
+        startup.mark('strips')
+        led_queue.first_light()
+        startup.mark('first light')
+        return led_queue
 
     async def run(self):
-        self.led_queue = LEDStripQueue(self.led_config, self.led_debug)
-        self.led_queue.init()
+        self.events = asyncio.Queue()
+        self.reconnect = asyncio.Event()
+        self.lights_on = asyncio.Event()
+        tasks = [asyncio.create_task(self.server_connection())]
+
+        try:
+            self.led_queue = await asyncio.get_running_loop().run_in_executor(None, self.start_leds)
+        except Exception as e:
+            # without lights there is nothing to connect for
+            for task in tasks:
+                task.cancel()
+            if self.server_connected:
+                self.connection_writer.close()
+            if self.led_queue is not None:
+                self.led_queue.close()
+            notify(f'STATUS=Startup failed: {e}')
+            raise
+        # the idle animation fades in from the static frame
+        await self.led_queue.clear()
         await self.led_queue.run(LEDStripQueue.STATUS_IDLE)
+        self.lights_on.set()
+        startup.mark('animations')
+
+        self.gpio = get_gpio(self.driver)
+        self.gpio.setwarnings(False)
+        self.gpio.setmode(self.gpio.BCM)
+        self.button = ButtonInput(self.gpio, self.button_pin, self.events, self.button_debounce_ms)
+        self.button.start()
+        startup.mark('button')
+
+        if self.trace_path and not tracer.enabled:
+            tracer.start(self.trace_path, self.trace_size)
+        if tracer.enabled:
+            install_dump_handlers()
+
+        if self.multicast_address:
+            from network.multicast import MulticastReceiver
+            self.multicast_receiver = MulticastReceiver(self.multicast_address, self.handle_multicast, self.request_sync)
+            await self.multicast_receiver.start()
+
+        metrics_server = None
+        if self.metrics_address:
+            metrics_server = await self.start_metrics()
+
+        tasks += [
+            asyncio.create_task(self.show_led()),
+            asyncio.create_task(self.get_status()),
+            asyncio.create_task(self.sync_clock()),
+        ]
+
+        if self.reload_interval > 0:
+            from service.config import ConfigWatcher
+            self.watcher = ConfigWatcher(self.reload_interval)
+            self.watcher.watch(self.server_config, self.reload_server_config)
+            self.watcher.watch(self.led_config, self.led_queue.reload)
+            tasks.append(asyncio.create_task(self.watcher.run()))
+
+        if metrics_server is not None:
+            from service.metrics import LoopLagMonitor
+            tasks.append(asyncio.create_task(LoopLagMonitor(self.metrics_registry).run()))
+
+        startup.mark('services')
+        print(startup.finish())
 
-        # show_led_task = asyncio.create_task(self.show_led())
-        get_status_task = asyncio.create_task(self.get_status())
-        connect_to_server_task = asyncio.create_task(self.connect_to_server())
         try:
-            # await asyncio.gather(show_led_task, get_status_task, connect_to_server_task)
-            await asyncio.gather(get_status_task, connect_to_server_task)
+            await asyncio.gather(*tasks)
         finally:
+            notify('STOPPING=1')
+            if metrics_server is not None:
+                metrics_server.close()
+            if self.multicast_receiver is not None:
+                self.multicast_receiver.close()
+            self.button.stop()
             if self.server_connected:
                 self.connection_writer.close()
-            await self.led_queue.clear()
+            await self.led_queue.blackout()
 
 
 if __name__ == "__main__":
-    IO.setwarnings(False)
-    IO.setmode(IO.BCM)
+    parser = argparse.ArgumentParser(description='Heart LED client')
+    parser.add_argument('--trace', help='record a Chrome trace, written on SIGUSR1 and on exit')
+    args = parser.parse_args()
+    if args.trace:
+        tracer.start(args.trace)
 
     client = Client(
         server_config=f"{os.getcwd()}/server.ini",
         led_config=f"{os.getcwd()}/led.ini"
     )
+    startup.mark('config')
     try:
         asyncio.run(client.run())
     except KeyboardInterrupt:
-        asyncio.run(client.led_queue.clear())
-        print('All strips are cleared successfully')
+        if client.led_queue is not None:
+            asyncio.run(client.led_queue.blackout())
+            client.led_queue.close()
+            print('All strips are cleared successfully')
     finally:
+        if tracer.enabled:
+            tracer.dump()
         asyncio.new_event_loop()
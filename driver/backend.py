@@ -0,0 +1,35 @@
+DRIVER_WS281X = 'ws281x'
+DRIVER_SIMULATED = 'simulated'
+DRIVERS = (DRIVER_WS281X, DRIVER_SIMULATED)
+
+# a WS281x pixel takes 24 bits on the wire, the strip latches after the reset low time
+BITS_PER_LED = 24
+RESET_TIME = 50e-6
+
+
+def transfer_time(count: int, freq_hz: int = 800000) -> float:
+    return count * BITS_PER_LED / freq_hz + RESET_TIME
+
+
+# Hardware modules are imported only when their driver is picked, so the
+# simulated driver works on machines without rpi_ws281x or RPi.GPIO
+def get_strip_class(driver: str = DRIVER_WS281X):
+    if driver == DRIVER_WS281X:
+        from driver.ws281x import Ws281xStrip
+        return Ws281xStrip
+    elif driver == DRIVER_SIMULATED:
+        from driver.simulated import SimulatedStrip
+        return SimulatedStrip
+
+    raise AttributeError(f'Unknown LED driver "{driver}"')
+
+
+def get_gpio(driver: str = DRIVER_WS281X):
+    if driver == DRIVER_WS281X:
+        import RPi.GPIO as IO
+        return IO
+    elif driver == DRIVER_SIMULATED:
+        from driver.simulated import gpio
+        return gpio
+
+    raise AttributeError(f'Unknown GPIO driver "{driver}"')
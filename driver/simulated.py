@@ -0,0 +1,139 @@
+import collections
+import time
+
+import numpy as np
+
+from driver.backend import transfer_time
+
+
+class SimulatedStrip:
+    # like ws2811_render, show() starts the transfer and returns, the next show() waits for it
+    # to finish; off by default to keep benchmarks fast
+    realtime: bool = False
+    # number of pushed frames kept in frames
+    history: int = 0
+
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0, strip_type=None,
+                 gamma=None):
+        self.size = num
+        self.pin = pin
+        self.freq_hz = freq_hz
+        self.dma = dma
+        self.channel = channel
+        self.brightness = brightness
+
+        self.buffer = np.zeros(num, dtype=np.uint32)
+        self.frames = collections.deque(maxlen=self.history)
+        self.begun = False
+        self.busy_until = 0.0
+
+        self.writes = 0
+        self.pixel_writes = 0
+        self.shows = 0
+        self.transfer_time = 0.0
+
+    def close(self):
+        self.begun = False
+
+    def frame_transfer_time(self) -> float:
+        return transfer_time(self.size, self.freq_hz)
+
+    def begin(self):
+        self.begun = True
+
+    def write(self, frame: np.ndarray, start: int = 0, stop: int = None):
+        if stop is None:
+            stop = len(frame)
+
+        self.buffer[start:stop] = frame[start:stop]
+        self.writes += 1
+        self.pixel_writes += stop - start
+
+    def show(self):
+        if not self.begun:
+            raise RuntimeError('Strip must be started with begin() before show()')
+
+        transfer_time = self.frame_transfer_time()
+        if self.realtime:
+            delay = self.busy_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.busy_until = time.monotonic() + transfer_time
+
+        self.shows += 1
+        self.transfer_time += transfer_time
+        if self.history:
+            self.frames.append(self.buffer.copy())
+
+    def setPixelColor(self, n, color):
+        self.buffer[n] = color
+        self.pixel_writes += 1
+
+    def getPixelColor(self, n):
+        return int(self.buffer[n])
+
+    def numPixels(self):
+        return self.size
+
+    def stats(self) -> dict:
+        return {
+            'writes': self.writes,
+            'pixel_writes': self.pixel_writes,
+            'shows': self.shows,
+            'transfer_time': self.transfer_time,
+        }
+
+
+class SimulatedGPIO:
+    # the subset of the RPi.GPIO module used by the client
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.callbacks = {}
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        # an unpressed button reads high
+        self.levels.setdefault(channel, self.HIGH)
+
+    def input(self, channel):
+        return self.levels.get(channel, self.HIGH)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.callbacks[channel] = callback
+
+    def remove_event_detect(self, channel):
+        self.callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        self.callbacks.clear()
+
+    def set_level(self, channel, level):
+        changed = self.levels.get(channel, self.HIGH) != level
+        self.levels[channel] = level
+        if changed and self.callbacks.get(channel) is not None:
+            self.callbacks[channel](channel)
+
+    def press(self, channel):
+        self.set_level(channel, self.LOW)
+
+    def release(self, channel):
+        self.set_level(channel, self.HIGH)
+
+
+gpio = SimulatedGPIO()
@@ -0,0 +1,44 @@
+import ctypes
+
+import numpy as np
+import _rpi_ws281x as ws
+from rpi_ws281x import PixelStrip
+
+from driver.backend import transfer_time
+
+
+class Ws281xStrip(PixelStrip):
+    leds_address: int = None
+    freq_hz: int = 800000
+
+    def __init__(self, num, pin, freq_hz=800000, *args, **kwargs):
+        super().__init__(num, pin, freq_hz, *args, **kwargs)
+        self.freq_hz = freq_hz
+
+    def close(self):
+        # frees the DMA channel so a strip on the same pin can be started again
+        self._cleanup()
+
+    def frame_transfer_time(self) -> float:
+        return transfer_time(self.size, self.freq_hz)
+
+    def begin(self):
+        super().begin()
+
+        # The LED buffer only exists after begin(), the SWIG pointer converts to its address
+        try:
+            self.leds_address = int(ws.ws2811_channel_t_leds_get(self._channel))
+        except (AttributeError, TypeError):
+            self.leds_address = None
+
+    def write(self, frame: np.ndarray, start: int = 0, stop: int = None):
+        if stop is None:
+            stop = len(frame)
+
+        if self.leds_address:
+            offset = start * frame.itemsize
+            ctypes.memmove(self.leds_address + offset, frame[start:stop].ctypes.data, (stop - start) * frame.itemsize)
+            return
+
+        for i, value in enumerate(frame[start:stop].tolist(), start):
+            ws.ws2811_led_set(self._channel, i, value)
@@ -0,0 +1,116 @@
+import collections
+
+import numpy as np
+
+
+class AnimationSequence:
+    # One period of an animation rendered ahead of time, one row of packed colors per frame and strip
+    key: tuple = None
+    fps: float = 60
+    length: int = 0
+    frames: dict = None
+
+    def __init__(self, key: tuple, fps: float, frames: dict):
+        self.key = key
+        self.fps = fps
+        self.frames = frames
+        self.length = len(next(iter(frames.values())))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(frames.nbytes for frames in self.frames.values())
+
+    def copy_frame(self, index: int, strips: dict):
+        index %= self.length
+        for name, strip in strips.items():
+            np.copyto(strip.frame, self.frames[name][index])
+
+
+def animation_key(state) -> tuple:
+    # everything the rendered frames depend on
+    return (
+        state.status, state.led_count, state.start_brightness, state.max_brightness, state.brightness_step,
+        state.wait_ms, state.current_led_step, state.video_brightness, state.fps,
+        state.color_red, state.color_green, state.color_blue, state.gamma,
+        state.layout.key,
+    )
+
+
+def compile_animation(state, key: tuple, max_frames: int):
+    steps = state.steps(1 / state.fps)
+    frames = []
+
+    snapshot = state.snapshot()
+    try:
+        # a period starts from a dark frame, the same way the chase restarts
+        state.levels.fill(0)
+        state.cycles = 0
+        while len(frames) < max_frames:
+            state.animate(steps)
+            frames.append(state.layout.render(state.palette, state.levels, np.empty(state.layout.size, np.uint32)))
+
+            if state.cycles:
+                break
+        else:
+            # the animation did not repeat within max_frames, it is rendered live instead
+            return None
+    finally:
+        state.restore(snapshot)
+
+    if not frames:
+        return None
+
+    # one array of physical frames, every strip gets a view on its pixels
+    return AnimationSequence(key, state.fps, state.layout.split(np.stack(frames)))
+
+
+class AnimationCache:
+    max_bytes: int = 8 * 1024 * 1024
+    max_seconds: float = 60
+    nbytes: int = 0
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024, max_seconds: float = 60):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.sequences = collections.OrderedDict()
+        # animations that do not repeat or do not fit, so they are not compiled again
+        self.uncacheable = set()
+
+    def get(self, state):
+        key = animation_key(state)
+        if key in self.uncacheable:
+            return None
+
+        sequence = self.sequences.get(key)
+        if sequence is not None:
+            self.sequences.move_to_end(key)
+            self.hits += 1
+            return sequence
+
+        self.misses += 1
+        sequence = compile_animation(state, key, int(self.max_seconds * state.fps))
+        if sequence is None or sequence.nbytes > self.max_bytes:
+            self.uncacheable.add(key)
+            return None
+
+        self.sequences[key] = sequence
+        self.nbytes += sequence.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.sequences.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+        return sequence
+
+    def stats(self) -> dict:
+        return {
+            'sequences': len(self.sequences),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def pack_color(red: int, green: int, blue: int) -> int:
+    return (int(red) << 16) | (int(green) << 8) | int(blue)
+
+
+def clamp_level(brightness) -> int:
+    return min(max(int(brightness), 0), 255)
+
+
+def brightness_table(color: tuple, gamma: float = 1.0) -> np.ndarray:
+    # One packed 0x00RRGGBB value per brightness level, so a whole frame of
+    # brightness levels becomes colors with a single table lookup
+    levels = np.arange(256, dtype=np.float64)
+    if gamma != 1.0:
+        levels = 255 * (levels / 255) ** gamma
+
+    red, green, blue = [(levels / 256 * float(channel)).astype(np.uint32) for channel in color]
+    return (red << 16) | (green << 8) | blue
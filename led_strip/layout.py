@@ -0,0 +1,137 @@
+from typing import Union
+
+import numpy as np
+
+# led.ini section describing how the strips make up one logical row of pixels:
+#   [layout]
+#   strips = left, right:59-0
+#   coordinates = /home/dude/heart.xy
+# Each entry of strips appends a strip, or a first-last range of its physical pixels, to
+# the logical order, a range with last < first runs backwards. coordinates has one x y
+# pair per logical pixel. Without the section every strip shows the logical pixels from
+# its first pixel on, the way a single strip config always did.
+LAYOUT = 'layout'
+
+
+def parse_segments(spec: str, strips: dict) -> list:
+    # 'left, right:59-0' -> [(strip name, first, last), ...]
+    segments = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        name, _, pixels = entry.partition(':')
+        name = name.strip()
+        if name not in strips:
+            raise AttributeError(f'Layout strip "{name}" is not configured')
+
+        count = strips[name].count
+        if pixels:
+            first, _, last = pixels.partition('-')
+            first, last = int(first), int(last or first)
+        else:
+            first, last = 0, count - 1
+        if not 0 <= first < count or not 0 <= last < count:
+            raise AttributeError(f'Layout range {entry} is outside of the {count} pixels of "{name}"')
+        segments.append((name, first, last))
+    return segments
+
+
+def read_coordinates(path: str, length: int) -> np.ndarray:
+    coordinates = np.loadtxt(path, dtype=np.float64, ndmin=2)
+    if coordinates.shape != (length, 2):
+        raise AttributeError(f'{path} needs one x y pair for each of the {length} logical pixels')
+    return coordinates
+
+
+class PixelLayout:
+    # Maps the logical pixels animations render to (strip, physical index). All strip
+    # frames are views on one physical buffer, so a frame is scattered to every strip
+    # with a single take through the precomputed source index.
+    length: int = 0
+    size: int = 0
+    # strip name -> (offset inside the physical buffer, pixel count)
+    strips: dict = None
+    # logical index shown by every physical pixel, length picks the black pixel past the end
+    source: np.ndarray = None
+    logical: np.ndarray = None
+    physical: np.ndarray = None
+    # logical pixel positions, and the flat index of each one in a width x height grid
+    coordinates: Union[np.ndarray, None] = None
+    grid: Union[np.ndarray, None] = None
+    width: int = 0
+    height: int = 0
+    key: tuple = None
+
+    def __init__(self, strips: dict, segments: list = None):
+        self.strips = {}
+        offset = 0
+        for name, strip in strips.items():
+            self.strips[name] = (offset, strip.count)
+            offset += strip.count
+        self.size = offset
+
+        if segments is None:
+            self.length = max([strip.count for strip in strips.values()], default=0)
+            self.source = np.concatenate([np.arange(strip.count) for strip in strips.values()] or [[]])
+        else:
+            self.length = sum(abs(last - first) + 1 for _, first, last in segments)
+            # physical pixels outside of every segment stay black
+            self.source = np.full(self.size, self.length)
+            logical = 0
+            for name, first, last in segments:
+                step = 1 if last >= first else -1
+                physical = self.strips[name][0] + np.arange(first, last + step, step)
+                self.source[physical] = np.arange(logical, logical + len(physical))
+                logical += len(physical)
+        self.source = self.source.astype(np.intp)
+
+        self.logical = np.zeros(self.length + 1, dtype=np.uint32)
+        self.physical = np.zeros(self.size, dtype=np.uint32)
+        self.key = (tuple((name, count) for name, (_, count) in self.strips.items()),
+                    None if segments is None else tuple(segments))
+
+    @classmethod
+    def from_config(cls, config, strips: dict) -> 'PixelLayout':
+        if LAYOUT not in config.sections():
+            return cls(strips)
+
+        section = config[LAYOUT]
+        segments = parse_segments(section.get('strips', ', '.join(strips)), strips)
+        layout = cls(strips, segments)
+        if 'coordinates' in section:
+            layout.place(read_coordinates(section['coordinates'], layout.length))
+        return layout
+
+    def place(self, coordinates: np.ndarray):
+        # x y per logical pixel, rounded to the cells of the smallest grid holding them all
+        self.coordinates = coordinates
+        cells = np.rint(coordinates - coordinates.min(axis=0)).astype(np.intp)
+        self.width, self.height = [int(size) + 1 for size in cells.max(axis=0)]
+        self.grid = cells[:, 1] * self.width + cells[:, 0]
+
+    def bind(self, strips: dict):
+        # the strip frames become views on the physical buffer and keep what they show
+        for name, strip in strips.items():
+            offset, count = self.strips[name]
+            frame = self.physical[offset:offset + count]
+            np.copyto(frame, strip.frame)
+            strip.frame = frame
+
+    def render(self, palette: np.ndarray, levels: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        # colors every logical pixel once, then scatters them to all strips in one pass
+        count = min(len(levels), self.length)
+        np.take(palette, levels[:count], out=self.logical[:count])
+        self.logical[count:].fill(0)
+        return np.take(self.logical, self.source, out=self.physical if out is None else out)
+
+    def split(self, physical: np.ndarray) -> dict:
+        # strip name -> view of its pixels, physical is the buffer or a stack of frames
+        return {name: physical[..., offset:offset + count] for name, (offset, count) in self.strips.items()}
+
+    def sample(self, image: np.ndarray, out: np.ndarray) -> np.ndarray:
+        # levels of a height x width image at the logical pixel positions
+        if self.grid is None:
+            raise AttributeError('The layout has no coordinates')
+        return np.take(image.reshape(-1), self.grid, out=out)
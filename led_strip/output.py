@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+import numpy as np
+
+from led_strip.unit import LedStrip
+
+
+def channel_groups(strips: dict) -> list:
+    # strips sharing a DMA channel or a PWM/PCM channel cannot transfer at the same time
+    groups = []
+    for name, strip in strips.items():
+        group = [name]
+        for linked in [group for group in groups
+                       if any(strips[other].dma == strip.dma or strips[other].channel == strip.channel
+                              for other in group)]:
+            groups.remove(linked)
+            group = linked + group
+        groups.append(group)
+    return groups
+
+
+class FrameSlot:
+    # Double buffer for one strip: the event loop fills the back buffer while the
+    # worker pushes the front one, the two only trade places under the lock
+    strip: LedStrip = None
+    group: int = 0
+    region: Union[tuple, None] = None
+    ready: bool = False
+    # the strip keeps transferring for a while after show() returns
+    busy_until: float = 0.0
+
+    def __init__(self, strip: LedStrip):
+        self.strip = strip
+        self.front = np.zeros(strip.count, dtype=np.uint32)
+        self.back = np.zeros(strip.count, dtype=np.uint32)
+
+    def fill(self, frame: np.ndarray, region: tuple) -> bool:
+        overwritten = self.ready
+        np.copyto(self.back, frame)
+        if overwritten:
+            # the overwritten frame never reached the strip, so its changes are still pending
+            region = min(region[0], self.region[0]), max(region[1], self.region[1])
+        self.region = region
+        self.ready = True
+        return overwritten
+
+    def swap(self) -> tuple:
+        self.front, self.back = self.back, self.front
+        region = self.region
+        self.region = None
+        self.ready = False
+        return self.front, region
+
+
+class OutputWorker(threading.Thread):
+    slots: dict = None
+    groups: list = None
+    # pushes independent channel groups at the same time, one thread per group
+    executor: Union[ThreadPoolExecutor, None] = None
+    running: bool = False
+
+    published: int = 0
+    shown: int = 0
+    overwritten: int = 0
+    dropped: int = 0
+    show_time: float = 0.0
+
+    def __init__(self, strips: dict, parallel: bool = True):
+        super().__init__(name='led-output', daemon=True)
+        self.slots = {name: FrameSlot(strip) for name, strip in strips.items()}
+        self.condition = threading.Condition()
+
+        self.groups = channel_groups(strips)
+        for index, group in enumerate(self.groups):
+            for name in group:
+                self.slots[name].group = index
+
+        if parallel and len(self.groups) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.groups), thread_name_prefix='led-channel')
+
+    def start(self):
+        self.running = True
+        super().start()
+
+    def stop(self, timeout: float = 1.0):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def publish(self, strips: dict) -> int:
+        published = 0
+        dropped = False
+        with self.condition:
+            for name, strip in strips.items():
+                region = strip.dirty_region()
+                if region is None:
+                    continue
+
+                if self.slots[name].fill(strip.frame, region):
+                    self.overwritten += 1
+                    dropped = True
+                strip.commit()
+                published += 1
+
+            if published:
+                self.published += 1
+                self.dropped += 1 if dropped else 0
+                self.condition.notify()
+
+        return published
+
+    def take(self) -> list:
+        with self.condition:
+            while self.running and not any(slot.ready for slot in self.slots.values()):
+                self.condition.wait()
+
+            return [(slot, *slot.swap()) for slot in self.slots.values() if slot.ready]
+
+    def push(self, jobs: list) -> float:
+        show_time = 0.0
+        for slot, frame, region in jobs:
+            # Sleep through the previous transfer here, where the GIL is released,
+            # so show() does not hold it while waiting for the DMA to finish
+            delay = slot.busy_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            start = time.monotonic()
+            slot.strip.output(frame, *region)
+            end = time.monotonic()
+            slot.busy_until = end + slot.strip.strip.frame_transfer_time()
+            show_time += end - start
+        return show_time
+
+    def run(self):
+        while True:
+            jobs = self.take()
+            if not jobs and not self.running:
+                return
+
+            if self.executor is None:
+                self.show_time += self.push(jobs)
+            else:
+                grouped = {}
+                for job in jobs:
+                    grouped.setdefault(job[0].group, []).append(job)
+                # the frame is done once every group has pushed, so it takes as long as the slowest group
+                futures = [self.executor.submit(self.push, group_jobs) for group_jobs in grouped.values()]
+                self.show_time += max(future.result() for future in futures)
+
+            self.shown += 1
+
+    def stats(self) -> dict:
+        return {
+            'published': self.published,
+            'shown': self.shown,
+            'overwritten': self.overwritten,
+            'dropped': self.dropped,
+            'show_time': self.show_time,
+            'groups': len(self.groups),
+        }
@@ -0,0 +1,109 @@
+import collections
+from typing import Union
+
+
+def wire_time(strips: dict, groups: list = None) -> float:
+    # strips of one channel group transfer one after the other, the groups at the same time
+    groups = groups or [list(strips)]
+    return max([sum(strips[name].strip.frame_transfer_time() for name in group if name in strips)
+                for group in groups], default=0.0)
+
+
+class FramePacer:
+    # Picks the frame rate this heart keeps up with: the slowest of composing a frame,
+    # pushing it and the wire time of the strips, with headroom for the rest of the loop.
+    # Animations advance by the elapsed time of each frame, so at a lower rate every
+    # frame takes a bigger led_step and brightness_step and the animation keeps its
+    # wall-clock duration.
+    target_fps: float = 60
+    min_fps: float = 15
+    # share of a frame interval the frame work may take
+    headroom: float = 0.7
+    fps: float = 60
+    # slow end of the compose times, and output seconds per pushed frame, of the last update
+    compose_seconds: float = 0.0
+    push_seconds: float = 0.0
+    wire_seconds: float = 0.0
+    changes: int = 0
+
+    def __init__(self, target_fps: float = 60, min_fps: float = 15, headroom: float = 0.7, window: int = 120):
+        self.target_fps = target_fps
+        self.fps = target_fps
+        self.output_mark = (0.0, 0)
+        self.configure(min_fps, headroom, window)
+
+    def configure(self, min_fps: float, headroom: float, window: int):
+        # the [service] pacing_* settings, applied again on a config reload
+        if headroom <= 0 or window < 1:
+            raise AttributeError('Pacing headroom and window must be positive')
+
+        self.min_fps = min(min_fps, self.target_fps)
+        self.headroom = headroom
+        # compose and publish time of the latest frames
+        self.compose = collections.deque(maxlen=int(window))
+
+    def record(self, seconds: float):
+        self.compose.append(seconds)
+
+    def retarget(self, target_fps: float):
+        self.target_fps = target_fps
+        self.min_fps = min(self.min_fps, target_fps)
+        self.fps = min(self.fps, target_fps)
+        self.compose.clear()
+
+    def slow_compose(self) -> float:
+        # a slow frame every few frames sets the pace, not the average one
+        if not self.compose:
+            return 0.0
+        ordered = sorted(self.compose)
+        return ordered[int(len(ordered) * 0.9)]
+
+    def measure_output(self, output):
+        show_time, shown = output.show_time, output.shown
+        if shown > self.output_mark[1]:
+            self.push_seconds = (show_time - self.output_mark[0]) / (shown - self.output_mark[1])
+        self.output_mark = (show_time, shown)
+
+    def achievable_fps(self) -> float:
+        cost = max(self.compose_seconds, self.push_seconds, self.wire_seconds)
+        if cost <= 0:
+            return self.target_fps
+        return min(max(self.headroom / cost, self.min_fps), self.target_fps)
+
+    def update(self, strips: dict, output=None) -> Union[float, None]:
+        # call once the window is full, returns the new frame rate when it should change
+        if len(self.compose) < self.compose.maxlen:
+            return None
+
+        if output is not None:
+            self.measure_output(output)
+        self.wire_seconds = wire_time(strips, output.groups if output is not None else None)
+        self.compose_seconds = self.slow_compose()
+        self.compose.clear()
+        fps = self.achievable_fps()
+
+        # a margin both ways keeps it from flapping, the target itself is always taken back
+        if fps < self.fps * 0.9 or fps > self.fps * 1.15 or (fps == self.target_fps != self.fps):
+            self.fps = round(fps, 1)
+            self.changes += 1
+            return self.fps
+        return None
+
+    def parameters(self, state) -> dict:
+        # what one frame does at the chosen rate, led_step and brightness_step per frame
+        frame_ms = 1000 / self.fps
+        steps = frame_ms / state.wait_ms if state.wait_ms > 0 else 1
+        return {
+            'fps': self.fps,
+            'target_fps': self.target_fps,
+            'min_fps': self.min_fps,
+            'headroom': self.headroom,
+            'window': self.compose.maxlen,
+            'frame_ms': frame_ms,
+            'wait_ms': state.wait_ms,
+            'led_step': state.current_led_step * steps,
+            'brightness_step': state.brightness_step * steps,
+            'compose_ms': self.compose_seconds * 1000,
+            'push_ms': self.push_seconds * 1000,
+            'wire_ms': self.wire_seconds * 1000,
+        }
@@ -0,0 +1,138 @@
+import mmap
+import struct
+import numpy as np
+
+# Show file layout, all little endian:
+#   header   magic, version, fps, frame count, strip count
+#   strips   one entry per strip: name, pixel count, pixel offset inside a frame
+#   frames   frame count frames, each one packed 0x00RRGGBB uint32 pixels of every strip back to back
+MAGIC = b'HRTS'
+VERSION = 1
+HEADER = struct.Struct('<4sHfIH')
+STRIP = struct.Struct('<32sII')
+PIXEL = np.dtype('<u4')
+
+
+class ShowFile:
+    path: str = None
+    fps: float = 0
+    frames: int = 0
+    # strip name -> (pixel count, pixel offset inside a frame)
+    strips: dict = None
+    frame_pixels: int = 0
+    data_offset: int = 0
+    # bytes before this offset were handed back to the kernel
+    released: int = 0
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as show_file:
+            self.mmap = mmap.mmap(show_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, fps, frames, strips = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise AttributeError(f'{path} is not a version {VERSION} show file')
+        if frames == 0 or not fps > 0:
+            raise AttributeError(f'{path} has no frames to play')
+
+        self.fps = fps
+        self.frames = frames
+        self.strips = {}
+        for i in range(strips):
+            name, count, offset = STRIP.unpack_from(self.mmap, HEADER.size + i * STRIP.size)
+            self.strips[name.rstrip(b'\0').decode()] = (count, offset)
+
+        self.frame_pixels = sum(count for count, _ in self.strips.values())
+        self.data_offset = HEADER.size + strips * STRIP.size
+        if len(self.mmap) < self.data_offset + self.frames * self.frame_pixels * PIXEL.itemsize:
+            raise AttributeError(f'{path} is truncated')
+
+        if hasattr(self.mmap, 'madvise'):
+            self.mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.fps
+
+    def frame_index(self, position: float) -> int:
+        # the last frame stays up once the show is over
+        return min(max(int(position * self.fps), 0), self.frames - 1)
+
+    def frame(self, index: int) -> np.ndarray:
+        # a view on the mapped file, nothing is copied
+        return np.frombuffer(self.mmap, dtype=PIXEL, count=self.frame_pixels,
+                             offset=self.data_offset + index * self.frame_pixels * PIXEL.itemsize)
+
+    def strip_frames(self, index: int) -> list:
+        frame = self.frame(index)
+        return [frame[offset:offset + count] for count, offset in self.strips.values()]
+
+    def copy_frame(self, index: int, strips: dict):
+        # pixels go straight from the mapped file into the strip buffers
+        frame = self.frame(index)
+        for name, (count, offset) in self.strips.items():
+            strip = strips.get(name)
+            if strip is not None:
+                pixels = min(count, strip.count)
+                np.copyto(strip.frame[:pixels], frame[offset:offset + pixels])
+        self.release(index)
+
+    def release(self, index: int):
+        # Played pages are dropped from the page cache, so memory use does not grow with the show length
+        if not hasattr(self.mmap, 'madvise'):
+            return
+
+        played = self.data_offset + index * self.frame_pixels * PIXEL.itemsize
+        played -= played % mmap.PAGESIZE
+        if played - self.released >= 64 * mmap.PAGESIZE:
+            self.mmap.madvise(mmap.MADV_DONTNEED, self.released, played - self.released)
+            self.released = played
+        elif played < self.released:
+            # playback started over
+            self.released = 0
+
+    def close(self):
+        self.mmap.close()
+
+
+class ShowWriter:
+    # Writes frames one at a time, so a show never has to fit in memory
+    def __init__(self, path: str, fps: float, strips: dict):
+        self.path = path
+        self.strips = dict(strips)
+        self.frames = 0
+        self.file = open(path, 'wb')
+
+        self.file.write(HEADER.pack(MAGIC, VERSION, fps, 0, len(self.strips)))
+        offset = 0
+        for name, count in self.strips.items():
+            encoded = name.encode()
+            if len(encoded) > STRIP.size - 8:
+                raise AttributeError(f'Strip name "{name}" is too long')
+            self.file.write(STRIP.pack(encoded, count, offset))
+            offset += count
+        self.fps = fps
+
+    def write(self, frame: dict):
+        # frame maps strip name -> packed uint32 pixels or (count, 3) RGB values
+        for name, count in self.strips.items():
+            pixels = np.zeros(count, dtype=PIXEL)
+            if name in frame:
+                values = np.asarray(frame[name])
+                if values.ndim == 2:
+                    values = values.astype(np.uint32)
+                    values = (values[:, 0] << 16) | (values[:, 1] << 8) | values[:, 2]
+                pixels[:min(count, len(values))] = values[:count]
+            self.file.write(pixels.tobytes())
+        self.frames += 1
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.fps, self.frames, len(self.strips)))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,8 +1,20 @@
 import asyncio
+import time
 from configparser import ConfigParser
 from typing import Union
 import statistics
 
+import numpy as np
+
+from driver.backend import DRIVER_WS281X
+from service.trace import traced
+from .animation import AnimationCache
+from .frame import brightness_table, clamp_level
+from .layout import LAYOUT, PixelLayout
+from .output import OutputWorker
+from .pacing import FramePacer
+from .playback import ShowFile
+from .scheduler import FrameScheduler
 from .state import LedStripState
 from .unit import LedStrip
 import configparser
@@ -19,31 +31,225 @@ class LEDStripQueue:
     config: ConfigParser = configparser.ConfigParser()
 
     led_state: LedStripState = None
+    scheduler: FrameScheduler = None
+    # lowers the frame rate to what the hardware keeps up with, when adaptive pacing is on
+    pacer: Union[FramePacer, None] = None
 
     active_animation: Union[asyncio.Task, None] = None
 
+    config_path: str = None
+    driver: str = DRIVER_WS281X
+    threaded_output: bool = True
+    parallel_output: bool = True
+    # aggregated settings per action, recomputed only when the strips change
+    settings: dict = None
+    # pre-rendered light show played instead of the video animation
+    light_show: Union[ShowFile, None] = None
+
+    metrics = None
+    frame_seconds = None
+    show_seconds = None
+
     debug = False
 
-    def __init__(self, config = None, debug = False):
+    def __init__(self, config = None, debug = False, fps = 60, driver = DRIVER_WS281X, threaded_output = True,
+                 parallel_output = True, animation_cache_mb = 8, show_file = None, transition_ms = 250,
+                 adaptive_pacing = False, pacing_min_fps = 15, pacing_headroom = 0.7, pacing_window = 120):
         if config is None:
             raise AttributeError('Config cannot be null')
 
-        self.config.read(config)
+        self.config_path = config
+        self.driver = driver
+        self.threaded_output = threaded_output
+        self.parallel_output = parallel_output
+        self.settings = {}
+
+        self.config = self.read_config()
 
         strips = {}
-        for section in self.config.sections():
-            self.config[section]['name'] = section
+        for section in self.strip_sections(self.config):
             strip = LedStrip(**self.config[section])
             strips[strip.name] = strip
 
-        self.led_state = LedStripState(**{"strips":strips})
+        self.led_state = LedStripState(**{"strips":strips, "layout": PixelLayout.from_config(self.config, strips)})
+        self.led_state.transition_seconds = transition_ms / 1000
+        if threaded_output:
+            self.led_state.output = OutputWorker(strips, parallel_output)
+        self.scheduler = FrameScheduler(fps)
+        self.led_state.fps = self.scheduler.fps
+        if adaptive_pacing:
+            self.pacer = FramePacer(self.scheduler.fps, pacing_min_fps, pacing_headroom, pacing_window)
+        if animation_cache_mb > 0:
+            self.led_state.cache = AnimationCache(int(animation_cache_mb * 1024 * 1024))
+
+        if show_file:
+            self.light_show = ShowFile(show_file)
+            show_only = set(self.light_show.strips) - set(strips)
+            config_only = set(strips) - set(self.light_show.strips)
+            if show_only:
+                print(f'LED: Strips {sorted(show_only)} of {show_file} are not in {config}')
+            if config_only:
+                print(f'LED: Strips {sorted(config_only)} of {config} are not in {show_file}')
 
         self.debug = debug
 
+    def read_config(self) -> ConfigParser:
+        config = configparser.ConfigParser()
+        config.read(self.config_path)
+        for section in self.strip_sections(config):
+            config[section]['name'] = section
+            if 'driver' not in config[section]:
+                config[section]['driver'] = self.driver
+        return config
+
+    @staticmethod
+    def strip_sections(config: ConfigParser) -> list:
+        return [section for section in config.sections() if section != LAYOUT]
+
+    async def reload(self, sections: set = None):
+        # Only strips whose pin, count, DMA or driver changed get a new PixelStrip,
+        # the others keep running and just take the new settings
+        config = self.read_config()
+        sections_now = self.strip_sections(config)
+        strips = dict(self.led_state.strips)
+        rebuild = [name for name in strips if name not in config.sections()]
+        update = []
+        for section in sections_now:
+            if section not in strips or strips[section].needs_rebuild(**config[section]):
+                rebuild.append(section)
+            elif sections is None or section in sections:
+                update.append(section)
+
+        # the new strips and mapping are ready before anything changes,
+        # a config they fail on leaves the running strips and output as they are
+        built = {}
+        try:
+            for name in rebuild:
+                if name in sections_now:
+                    strip = LedStrip(**config[name])
+                    strip.show_seconds = self.show_seconds
+                    strip.init()
+                    built[name] = strip
+
+            old = {name: strips.pop(name) for name in rebuild if name in strips}
+            strips.update(built)
+            layout = None
+            if rebuild or sections is None or LAYOUT in sections:
+                layout = PixelLayout.from_config(config, strips)
+        except Exception:
+            for strip in built.values():
+                strip.close()
+            raise
+
+        for section in update:
+            strips[section].setattrs(**config[section])
+
+        if rebuild:
+            # only the strips being replaced go dark
+            for strip in old.values():
+                strip.frame.fill(0)
+            self.led_state.push()
+            if self.led_state.output is not None:
+                self.led_state.output.stop()
+
+            self.led_state.strips = strips
+            for strip in old.values():
+                strip.close()
+            if self.threaded_output:
+                self.led_state.output = OutputWorker(strips, self.parallel_output)
+                self.led_state.output.start()
+
+        if layout is not None:
+            # new strips or a new mapping, the frames move into a new physical buffer
+            self.led_state.layout = layout
+            layout.bind(strips)
+
+        self.config = config
+        self.settings = {}
+
+        if self.debug:
+            print(f'LED: Reloaded config, rebuilt strips: {rebuild}')
+
+        # restart the running animation with the new settings
+        if self.active_animation is not None:
+            await self.active_animation()
+
+    def instrument(self, metrics):
+        # metrics is a service.metrics.Registry, values of replaced objects are read at scrape time
+        self.metrics = metrics
+        self.frame_seconds = metrics.histogram('heart_frame_seconds', 'Time to compose and publish one frame')
+        self.show_seconds = metrics.histogram('heart_strip_show_seconds', 'Time spent in write and show() per strip')
+        for strip in self.led_state.strips.values():
+            strip.show_seconds = self.show_seconds
+
+        metrics.counter('heart_frames_total', 'Frames scheduled', lambda: self.scheduler.frames)
+        metrics.counter('heart_frames_late_total', 'Frames that missed their deadline',
+                        lambda: self.scheduler.late_frames)
+        metrics.counter('heart_frames_dropped_total', 'Frame slots skipped after late frames',
+                        lambda: self.scheduler.dropped_frames)
+        metrics.gauge('heart_fps_target', 'Target frame rate', lambda: self.scheduler.fps)
+        if self.pacer is not None:
+            metrics.gauge('heart_pacing', 'Frame rate and per frame steps chosen by adaptive pacing',
+                          lambda: {(('parameter', name),): value
+                                   for name, value in self.pacing_parameters().items()})
+            metrics.counter('heart_pacing_changes_total', 'Frame rate changes by adaptive pacing',
+                            lambda: self.pacer.changes)
+        metrics.counter('heart_clears_collapsed_total', 'Clears folded into one already waiting for a frame',
+                        lambda: self.led_state.collapsed_clears)
+        if self.threaded_output:
+            metrics.counter('heart_output_frames_overwritten_total', 'Strip frames replaced before they were shown',
+                            lambda: self.led_state.output.overwritten)
+            metrics.counter('heart_output_frames_shown_total', 'Frames pushed by the output worker',
+                            lambda: self.led_state.output.shown)
+        if self.led_state.cache is not None:
+            metrics.counter('heart_animation_cache_hits_total', 'Animation cache hits',
+                            lambda: self.led_state.cache.hits)
+            metrics.counter('heart_animation_cache_misses_total', 'Animation cache misses',
+                            lambda: self.led_state.cache.misses)
+            metrics.gauge('heart_animation_cache_bytes', 'Bytes of compiled animation frames',
+                          lambda: self.led_state.cache.nbytes)
+
+    def set_fps(self, fps: float):
+        self.scheduler = FrameScheduler(fps)
+        self.led_state.fps = self.scheduler.fps
+        if self.pacer is not None:
+            self.pacer.retarget(self.scheduler.fps)
+
+    def pace(self, frame_seconds: float):
+        # the compiled periods stay at the target rate, they are replayed by time
+        self.pacer.record(frame_seconds)
+        fps = self.pacer.update(self.led_state.strips, self.led_state.output)
+        if fps is None:
+            return
+
+        self.scheduler.set_fps(fps)
+        if self.debug:
+            print(f'LED: Pacing {self.pacing_parameters()}')
+
+    def pacing_parameters(self) -> dict:
+        if self.pacer is None:
+            return {'fps': self.scheduler.fps, 'wait_ms': self.led_state.wait_ms}
+        return self.pacer.parameters(self.led_state)
+
     def init(self):
+        if self.led_state.output is not None:
+            self.led_state.output.start()
+
         if self.debug:
             print('LED: LED strip init complete')
+            if self.led_state.output is not None:
+                print(f'LED: Output channel groups: {self.led_state.output.groups}')
 
+    def first_light(self) -> int:
+        # a static frame at idle brightness, shown before any animation is prepared or compiled
+        settings = self.get_led_settings('idle')
+        state = self.led_state
+        palette = brightness_table((state.color_red, state.color_green, state.color_blue), settings['gamma'])
+        levels = np.full(state.layout.length, clamp_level(settings['max_brightness']), dtype=np.uint8)
+        state.layout.render(palette, levels)
+        return state.push()
+
+    @traced('LEDStripQueue.run')
     async def run(self, status: int):
         if status not in self.STATUSES.keys():
             raise AttributeError('Invalid status')
@@ -58,8 +264,24 @@ class LEDStripQueue:
         await self.active_animation()
         await asyncio.sleep(0)
 
-    async def show(self):
-        await self.led_state.show()
+    async def show(self) -> int:
+        elapsed = await self.scheduler.wait()
+        started = time.perf_counter()
+        pushed = await self.led_state.show(elapsed)
+        frame_seconds = time.perf_counter() - started
+        if self.frame_seconds is not None:
+            self.frame_seconds.observe(frame_seconds)
+        if self.pacer is not None:
+            self.pace(frame_seconds)
+
+        if self.debug and self.scheduler.frames % int(self.scheduler.fps * 10) == 0:
+            print(f'LED: Frames: {self.scheduler.stats()}')
+            if self.led_state.output is not None:
+                print(f'LED: Output: {self.led_state.output.stats()}')
+            if self.led_state.cache is not None:
+                print(f'LED: Animation cache: {self.led_state.cache.stats()}')
+
+        return pushed
 
     async def idle(self, color = None, wait_ms = None, brightness_step = None):
         if self.debug:
@@ -77,6 +299,8 @@ class LEDStripQueue:
 
         settings['status'] = 0
 
+        self.led_state.light_show = None
+        self.led_state.started_at = None
         self.led_state.setattrs(**settings)
 
     async def video(self, color=None, wait_ms=None, brightness_step=None):
@@ -97,14 +321,33 @@ class LEDStripQueue:
 
         settings['status'] = 1
 
+        self.led_state.light_show = self.light_show
+        if self.led_state.started_at is None:
+            # the start time from the server replaces this once it arrives
+            self.led_state.started_at = self.led_state.clock()
         self.led_state.setattrs(**settings)
 
+    def sync_start(self, start_at: float):
+        # start_at is the server time the video starts at, it can be in the future
+        self.led_state.started_at = start_at
+        self.led_state.phase = 0.0
+        if self.debug:
+            print(f'LED: Video starts in {start_at - self.led_state.clock():.3f} s')
+
     def get_led_settings(self, action: str) -> dict:
+        if action not in self.settings:
+            self.settings[action] = self.compute_led_settings(action)
+
+        # callers adjust the result, so they get their own copy
+        return dict(self.settings[action])
+
+    def compute_led_settings(self, action: str) -> dict:
         for field in ('brightness', 'wait_ms', 'led_step'):
             if not getattr(list(self.led_state.strips.values())[0], f"{action}_{field}"):
                 raise AttributeError('Invalid action')
 
-        led_count = max([strip.count for strip in self.led_state.strips.values()])
+        # the animations run over the logical pixels of the layout
+        led_count = self.led_state.layout.length
         if action == 'idle':
             start_brightness = min([strip.black_brightness  for strip in self.led_state.strips.values()])
         else:
@@ -114,6 +357,7 @@ class LEDStripQueue:
         wait_ms = statistics.mean([getattr(strip, f"{action}_wait_ms") for strip in self.led_state.strips.values()])
 
         led_step = max([strip.video_led_step for strip in self.led_state.strips.values()])
+        gamma = statistics.mean([strip.gamma for strip in self.led_state.strips.values()])
 
         result = {
             'led_count': led_count,
@@ -121,7 +365,8 @@ class LEDStripQueue:
             'max_brightness': max_brightness,
             'brightness_step': brightness_step,
             'led_step': led_step,
-            'wait_ms': wait_ms
+            'wait_ms': wait_ms,
+            'gamma': gamma
         }
 
         if self.debug:
@@ -130,10 +375,23 @@ class LEDStripQueue:
         return result
 
 
+    @traced('LEDStripQueue.clear')
     async def clear(self):
+        # the next animation fades in over the current frames with the next pushed frame
         if self.debug:
             print('LED: Cleared LED strip')
 
-        await self.led_state.clear()
+        self.led_state.begin_transition()
 
-        self.active_animation = None
\ No newline at end of file
+        self.active_animation = None
+
+    async def blackout(self):
+        await self.led_state.clear()
+        self.active_animation = None
+
+    def close(self):
+        # pending frames are still pushed before the output thread exits
+        if self.led_state.output is not None:
+            self.led_state.output.stop()
+        if self.light_show is not None:
+            self.light_show.close()
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+
+class FrameScheduler:
+    fps: float = 60.0
+    frame_time: float = 1 / 60.0
+    # elapsed time handed to animations is capped so a long stall does not skip a whole animation
+    max_elapsed: float = 0.25
+
+    frames: int = 0
+    late_frames: int = 0
+    dropped_frames: int = 0
+
+    next_deadline: float = None
+    last_tick: float = None
+
+    def __init__(self, fps: float = 60.0):
+        if fps <= 0:
+            raise AttributeError('Frame rate must be positive')
+
+        self.fps = float(fps)
+        self.frame_time = 1 / self.fps
+
+    def set_fps(self, fps: float):
+        # keeps the counters and moves the next deadline to the new interval
+        if fps <= 0:
+            raise AttributeError('Frame rate must be positive')
+
+        self.fps = float(fps)
+        self.frame_time = 1 / self.fps
+        if self.last_tick is not None:
+            self.next_deadline = self.last_tick + self.frame_time
+
+    def start(self):
+        self.last_tick = self.next_deadline = time.monotonic()
+
+    async def wait(self) -> float:
+        if self.next_deadline is None:
+            self.start()
+
+        delay = self.next_deadline - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        lateness = now - self.next_deadline
+        if lateness > self.frame_time:
+            # whole frames we missed are dropped, the schedule resumes from the next slot
+            missed = int(lateness // self.frame_time)
+            self.late_frames += 1
+            self.dropped_frames += missed
+            self.next_deadline += missed * self.frame_time
+
+        self.next_deadline += self.frame_time
+        self.frames += 1
+
+        elapsed = now - self.last_tick
+        self.last_tick = now
+        return min(elapsed, self.max_elapsed)
+
+    def stats(self) -> dict:
+        return {
+            'fps': self.fps,
+            'frames': self.frames,
+            'late_frames': self.late_frames,
+            'dropped_frames': self.dropped_frames,
+        }
@@ -1,8 +1,18 @@
 import asyncio
+import math
+import time
 from typing import Union
 
+import numpy as np
+
+from led_strip.animation import AnimationCache, AnimationSequence
+from led_strip.frame import brightness_table, clamp_level
+from led_strip.layout import PixelLayout
+from led_strip.output import OutputWorker
+from led_strip.playback import ShowFile
+from led_strip.transition import Transition
 from led_strip.unit import LedStrip
-from rpi_ws281x import Color
+from service.trace import traced
 
 
 class LedStripState:
@@ -35,8 +45,17 @@ class LedStripState:
     color_red = 255
     color_green = 116
     color_blue = 0
+    gamma: float = 1.0
+
+    # brightness level -> packed color lookup and the logical frame of brightness levels
+    palette: np.ndarray = None
+    levels: np.ndarray = None
 
     strips: dict[str, LedStrip] = {}
+    # logical pixels the animations render -> physical strip pixels
+    layout: Union[PixelLayout, None] = None
+    # pushes frames from its own thread when set, otherwise strips are shown inline
+    output: Union[OutputWorker, None] = None
     active_animation: Union[asyncio.Task, None] = None
 
 
@@ -45,10 +64,34 @@ class LedStripState:
     current_led_count: int = 1
     current_led_step: int = 1
     reverse: bool = False
+    # completed animation periods, counted on the last frame of a full breath or a full chase
+    cycles: int = 0
+
+    fps: float = 60
+    cache: Union[AnimationCache, None] = None
+    sequence: Union[AnimationSequence, None] = None
+    phase: float = 0.0
+    # the video plays from the mapped show file
+    light_show: Union[ShowFile, None] = None
+    # the video is positioned by the synchronized clock from this server time on
+    started_at: Union[float, None] = None
+    clock = staticmethod(time.time)
+    # network.stream.FrameDecoder writing live frames from the server into the strip buffers
+    stream = None
+
+    # crossfade from the last frames before a clear into the next animation
+    transition: Union[Transition, None] = None
+    transition_seconds: float = 0.25
+    # a clear is waiting for the next frame, the ones after it are folded into it
+    cleared: bool = False
+    collapsed_clears: int = 0
 
 
     def __init__(self, *args, **kwargs):
         self.setattrs(*args, **kwargs)
+        if self.layout is None:
+            self.layout = PixelLayout(self.strips)
+        self.layout.bind(self.strips)
         for strip in self.strips.values():
             strip.init()
 
@@ -58,14 +101,17 @@ class LedStripState:
         self.current_led_count: int = 1
         self.current_led_step: int = 1
         self.reverse: bool = False
+        self.cycles: int = 0
 
         for fieldName, fieldValue in kwargs.items():
             if hasattr(self, fieldName):
                 if fieldName in [
                     "led_count", "brightness_step", "video_led_step",
-                    "wait_ms", "start_brightness", "max_brightness",
+                    "start_brightness", "max_brightness",
                     "current_brightness"]:
                     setattr(self, fieldName, int(fieldValue))
+                elif fieldName in ["gamma", "wait_ms"]:
+                    setattr(self, fieldName, float(fieldValue))
                 else:
                     setattr(self, fieldName, fieldValue)
             else:
@@ -73,64 +119,132 @@ class LedStripState:
 
         self.current_led_num = 0
 
-    async def show(self):
-        color = (self.color_red, self.color_green, self.color_blue)
-
+        self.palette = brightness_table((self.color_red, self.color_green, self.color_blue), self.gamma)
+        if self.levels is None or len(self.levels) != self.led_count:
+            self.levels = np.zeros(self.led_count, dtype=np.uint8)
+
+        self.phase = 0.0
+        self.sequence = None
+        if self.cache is not None and self.strips and self.light_show is None:
+            self.sequence = self.cache.get(self)
+
+    def steps(self, elapsed: float = None) -> float:
+        # wait_ms is the intended time between two animation steps
+        if elapsed is None or self.wait_ms <= 0:
+            return 1
+        return elapsed * 1000.0 / self.wait_ms
+
+    @traced('LedStripState.show')
+    async def show(self, elapsed: float = None) -> int:
+        frame_time = elapsed if elapsed is not None else 1 / self.fps
+        synced = self.started_at is not None
+        if synced:
+            # every heart computes the same position from the same start, however late its message came
+            position = self.clock() - self.started_at
+            if position < 0:
+                # holds the current frame until the common start, a running crossfade
+                # moves on toward the first frame of the animation instead
+                if self.transition is None:
+                    self.cleared = False
+                    return self.push()
+                position = 0.0
+            elapsed = max(position - self.phase, 0.0)
+            self.phase = position
+
+        if self.stream is not None and self.stream.active:
+            # streamed frames are already in the strip buffers, a crossfade written into them
+            # would stay in every pixel the next deltas leave alone
+            self.transition = None
+        elif self.light_show is not None and self.status == self.STATUS_VIDEO:
+            self.light_show.copy_frame(self.light_show.frame_index(self.phase), self.strips)
+        elif self.sequence is not None:
+            # replay the precompiled period by position in time instead of rendering it again,
+            # at whatever rate the frames are shown
+            self.sequence.copy_frame(round(self.phase * self.sequence.fps), self.strips)
+            if not synced:
+                self.phase += elapsed if elapsed is not None else 1 / self.fps
+        else:
+            self.animate(self.steps(elapsed))
+            self.render()
+
+        if self.transition is not None and not self.transition.apply(self.strips, frame_time):
+            self.transition = None
+
+        self.cleared = False
+        return self.push()
+
+    def animate(self, steps: float):
         if self.status == self.STATUS_IDLE:
             if self.current_brightness >= self.max_brightness:
                 self.reverse = True
             elif self.current_brightness < self.start_brightness:
+                if self.reverse:
+                    self.cycles += 1
                 self.reverse = False
 
-            for pixel_num in range(0, self.led_count):
-                self.update_all_strips(pixel_num, color, self.current_brightness)
-
-            for strip in self.strips.values():
-                strip.show()
+            self.levels.fill(clamp_level(self.current_brightness))
 
             if self.reverse:
-                self.current_brightness -= self.brightness_step
+                self.current_brightness -= self.brightness_step * steps
             else:
-                self.current_brightness += self.brightness_step
+                self.current_brightness += self.brightness_step * steps
 
         elif self.status == self.STATUS_VIDEO:
             self.current_brightness = self.video_brightness
             if self.current_led_num >= self.led_count:
-                await self.clear()
+                # start over from a dark frame, pushed together with the first pixel
+                self.levels.fill(0)
                 self.current_led_num = 0
 
-            for i in range(self.current_led_num, self.current_led_num + self.current_led_step,
-                           self.current_led_step):
-                self.update_all_strips(i, color, self.current_brightness)
+            next_led_num = min(self.current_led_num + self.current_led_step * steps, self.led_count)
+            self.levels[math.ceil(self.current_led_num):math.ceil(next_led_num)] = clamp_level(self.current_brightness)
 
-                for strip in self.strips.values():
-                    strip.show()
+            self.current_led_num = next_led_num
+            if next_led_num >= self.led_count:
+                self.cycles += 1
 
-            self.current_led_num = self.current_led_num + self.current_led_step
+            self.current_brightness += self.brightness_step * steps
 
-            self.current_brightness += self.brightness_step
+    def snapshot(self) -> tuple:
+        return (self.current_brightness, self.current_led_num, self.reverse, self.cycles,
+                None if self.levels is None else self.levels.copy())
 
-        await asyncio.sleep(self.wait_ms / 100000.0)
+    def restore(self, snapshot: tuple):
+        self.current_brightness, self.current_led_num, self.reverse, self.cycles, levels = snapshot
+        if levels is not None:
+            np.copyto(self.levels, levels)
 
+    def render(self):
+        # the strip frames are views on the layout's physical buffer
+        self.layout.render(self.palette, self.levels)
 
-    def update_all_strips(self, pixel_num: int, color: Color, brightness: int):
-        for strip in self.strips.values():
-            self.update_strip(strip, pixel_num, color, brightness)
+    def push(self) -> int:
+        # every strip is pushed at most once per frame and only when its frame changed
+        if self.output is not None and self.output.is_alive():
+            return self.output.publish(self.strips)
+        return len([strip for strip in self.strips.values() if strip.show()])
 
-    def update_strip(self, strip: LedStrip, pixel_num: int, color: Color, brightness: int):
-        if pixel_num > strip.count:
+    def begin_transition(self):
+        # every clear before the next frame fades from the same picture and costs no push of its own
+        if self.cleared:
+            self.collapsed_clears += 1
             return
 
-        strip.strip.setPixelColor(
-            pixel_num,
-            Color(
-                int(brightness / 256 * color[0]),
-                int(brightness / 256 * color[1]),
-                int(brightness / 256 * color[2])
-            )
-
-        )
+        self.cleared = True
+        if self.transition_seconds > 0:
+            self.transition = Transition(self.strips, self.transition_seconds)
+        else:
+            for strip in self.strips.values():
+                strip.frame.fill(0)
+        if self.levels is not None:
+            self.levels.fill(0)
 
     async def clear(self):
+        # goes dark right away, for shutdown
+        self.transition = None
+        if self.levels is not None:
+            self.levels.fill(0)
+
         for strip in self.strips.values():
-            strip.clear()
\ No newline at end of file
+            strip.frame.fill(0)
+        self.push()
\ No newline at end of file
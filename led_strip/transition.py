@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class Transition:
+    # Crossfades from the frames the strips showed when it began to whatever the
+    # incoming animation renders, one weighted blend per channel on the frame buffers.
+    duration: float = 0.25
+    position: float = 0.0
+
+    def __init__(self, strips: dict, duration: float):
+        self.duration = duration
+        self.outgoing = {name: strip.frame.copy() for name, strip in strips.items()}
+        # the blend needs room above 8 bits, scratch buffers keep it free of allocations
+        self.scratch = {name: (np.empty(strip.count * 4, dtype=np.uint16), np.empty(strip.count * 4, dtype=np.uint16))
+                        for name, strip in strips.items()}
+
+    def apply(self, strips: dict, elapsed: float) -> bool:
+        # blends into the strip buffers and returns False once the incoming frames are shown alone
+        self.position += elapsed
+        if self.position >= self.duration:
+            return False
+
+        weight = int(self.position / self.duration * 256)
+        for name, strip in strips.items():
+            outgoing = self.outgoing.get(name)
+            if outgoing is None or len(outgoing) != len(strip.frame):
+                continue
+
+            blended, incoming = self.scratch[name]
+            frame = strip.frame.view(np.uint8)
+            np.multiply(outgoing.view(np.uint8), 256 - weight, out=blended, dtype=np.uint16)
+            np.multiply(frame, weight, out=incoming, dtype=np.uint16)
+            blended += incoming
+            blended >>= 8
+            np.copyto(frame, blended, casting='unsafe')
+        return True
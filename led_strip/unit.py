@@ -1,9 +1,17 @@
-import asyncio
+from typing import Union
+
 import time
-from rpi_ws281x import PixelStrip, Color
+
+import numpy as np
+
+from driver.backend import DRIVER_WS281X, get_strip_class
+from service.trace import traced
 
 
 class LedStrip:
+    # changing any of these needs a new PixelStrip, everything else is applied in place
+    HARDWARE_FIELDS = ["count", "pin", "freqz", "dma", "invert", "driver"]
+
     name = ""
 
     count = -1
@@ -12,6 +20,7 @@ class LedStrip:
     dma = 10  # DMA channel to use for generating signal (try 10)
     invert = False  # True to invert the signal (when using NPN transistor level shift)
     channel = 0  #set to '1' for GPIOs 13, 19, 41, 45 or 53
+    driver = DRIVER_WS281X
 
     video_brightness = 255
     idle_brightness = 145
@@ -26,8 +35,17 @@ class LedStrip:
     color_red = 255
     color_green = 116
     color_blue = 0
+    gamma = 1.0
 
     strip = None
+    frame: np.ndarray = None
+    # service.metrics.Histogram of write and show() durations, when metrics are enabled
+    show_seconds = None
+
+    # last frame pushed to the strip, used to skip pushes that would not change anything
+    shown: np.ndarray = None
+    changed: np.ndarray = None
+    synced: bool = False
 
 
     def __init__(self, **kwargs):
@@ -35,28 +53,77 @@ class LedStrip:
             if arg not in kwargs:
                 raise AttributeError(f"Argument {arg} is required")
 
+        self.setattrs(**kwargs)
+
+        if self.pin < 1 or self.count < 1:
+            raise AttributeError(f"Arguments led pin and led count is required")
+
+        self.channel = 1 if self.pin in [13, 19, 41, 45, 53] else 0
+        self.strip = get_strip_class(self.driver)(self.count, self.pin, self.freqz, self.dma, self.invert, 255, self.channel)
+        self.frame = np.zeros(self.count, dtype=np.uint32)
+        self.shown = np.zeros(self.count, dtype=np.uint32)
+        self.changed = np.zeros(self.count, dtype=bool)
+
+    def setattrs(self, **kwargs):
         for fieldName, fieldValue in kwargs.items():
             if hasattr(self, fieldName):
-                if fieldName in ["pin", "count", "idle_brightness_step", "video_brightness_step", "video_led_step"]:
+                if fieldName in ["pin", "count", "freqz", "dma", "idle_brightness_step", "video_brightness_step",
+                                 "video_led_step", "video_brightness", "idle_brightness", "black_brightness"]:
                     setattr(self, fieldName, int(fieldValue))
-                elif fieldName in ["color_red", "color_green", "color_blue", "idle_wait_ms", "video_wait_ms"]:
+                elif fieldName in ["color_red", "color_green", "color_blue", "idle_wait_ms", "video_wait_ms", "gamma"]:
                     setattr(self, fieldName, float(fieldValue))
                 else:
                     setattr(self, fieldName, fieldValue)
 
-        if self.pin < 1 or self.count < 1:
-            raise AttributeError(f"Arguments led pin and led count is required")
-
-        self.channel = 1 if self.pin in [13, 19, 41, 45, 53] else 0
-        self.strip = PixelStrip(self.count, self.pin, self.freqz, self.dma, self.invert, 255, self.channel)
+    def needs_rebuild(self, **kwargs) -> bool:
+        for field in self.HARDWARE_FIELDS:
+            if str(kwargs.get(field, getattr(LedStrip, field))) != str(getattr(self, field)):
+                return True
+        return False
 
     def init(self):
         self.strip.begin()
 
-    def show(self):
-        self.strip.show()
+    def close(self):
+        if hasattr(self.strip, 'close'):
+            self.strip.close()
+
+    def dirty_region(self) -> Union[tuple, None]:
+        if not self.synced:
+            return 0, self.count
+
+        np.not_equal(self.frame, self.shown, out=self.changed)
+        changed = np.flatnonzero(self.changed)
+        if not len(changed):
+            return None
 
-    def clear(self):
-        for i in range(self.count):
-            self.strip.setPixelColor(i, Color(0, 0, 0))
+        return int(changed[0]), int(changed[-1]) + 1
+
+    @traced('LedStrip.show', 'hardware')
+    def output(self, frame: np.ndarray, start: int = 0, stop: int = None):
+        if self.show_seconds is None:
+            self.strip.write(frame, start, stop)
+            self.strip.show()
+            return
+
+        started = time.perf_counter()
+        self.strip.write(frame, start, stop)
         self.strip.show()
+        self.show_seconds.observe(time.perf_counter() - started)
+
+    def commit(self):
+        np.copyto(self.shown, self.frame)
+        self.synced = True
+
+    def show(self) -> bool:
+        region = self.dirty_region()
+        if region is None:
+            return False
+
+        self.output(self.frame, *region)
+        self.commit()
+        return True
+
+    def clear(self) -> bool:
+        self.frame.fill(0)
+        return self.show()
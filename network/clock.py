@@ -0,0 +1,48 @@
+import collections
+import struct
+import time
+
+# client send time
+PING = struct.Struct('!d')
+# client send time, server receive time, server send time
+PONG = struct.Struct('!ddd')
+
+
+def pong_payload(ping: bytes, received: float) -> bytes:
+    sent_at, = PING.unpack(ping)
+    return PONG.pack(sent_at, received, time.time())
+
+
+class ClockSync:
+    # NTP style offset between the local and the server wall clock. Of the last few
+    # samples the one with the shortest round trip wins, it had the least queueing
+    # delay to hide an asymmetric path.
+    offset: float = 0.0
+    rtt: float = None
+
+    def __init__(self, samples: int = 8):
+        self.samples = collections.deque(maxlen=samples)
+        self.pings = 0
+        self.pongs = 0
+
+    def ping(self) -> bytes:
+        self.pings += 1
+        return PING.pack(time.time())
+
+    def pong(self, payload: bytes) -> float:
+        received = time.time()
+        sent_at, server_received, server_sent = PONG.unpack(payload)
+        rtt = (received - sent_at) - (server_sent - server_received)
+        offset = ((server_received - sent_at) + (server_sent - received)) / 2
+        self.samples.append((rtt, offset))
+        self.rtt, self.offset = min(self.samples)
+        self.pongs += 1
+        return offset
+
+    def reset(self):
+        # a new connection can take a different path
+        self.samples.clear()
+
+    def now(self) -> float:
+        # the server wall clock
+        return time.time() + self.offset
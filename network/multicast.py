@@ -0,0 +1,121 @@
+import asyncio
+import os
+import socket
+import struct
+import time
+from typing import Callable, Union
+
+from network.protocol import HEADER, MAGIC, Message, Protocol, TYPE_HELLO
+
+# id of the sending process, sequence numbers of the server workers are independent
+SENDER = struct.Struct('!I')
+# server time in the periodic beacon
+BEACON = struct.Struct('!d')
+
+
+def parse_address(address: str) -> tuple:
+    group, port = address.rsplit(':', 1)
+    return group, int(port)
+
+
+class MulticastSender(asyncio.DatagramProtocol):
+    # Sends every packet once right away and repeats the same bytes a few times shortly
+    # after, a lost datagram costs a retransmit interval instead of a TCP catch-up.
+    def __init__(self, address: str, ttl: int = 1, repeats: int = 2, repeat_interval: float = 0.02):
+        self.group, self.port = parse_address(address)
+        self.ttl = ttl
+        self.repeats = repeats
+        self.repeat_interval = repeat_interval
+        self.protocol = Protocol(True)
+        self.sender = int.from_bytes(os.urandom(SENDER.size), 'big')
+        self.transport: Union[asyncio.DatagramTransport, None] = None
+        self.sent = 0
+
+    async def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setblocking(False)
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, sock=sock)
+
+    def send(self, message_type: int, payload: bytes = b''):
+        if self.transport is None:
+            return
+
+        packet = SENDER.pack(self.sender) + self.protocol.encode(message_type, payload)
+        loop = asyncio.get_running_loop()
+        for repeat in range(self.repeats + 1):
+            loop.call_later(repeat * self.repeat_interval, self.transport.sendto, packet, (self.group, self.port))
+        self.sent += 1
+
+    async def beacon(self, interval: float = 1.0):
+        # keeps the sequence numbers moving, so a client notices a lost packet within an interval
+        while True:
+            self.send(TYPE_HELLO, BEACON.pack(time.time()))
+            await asyncio.sleep(interval)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class MulticastReceiver(asyncio.DatagramProtocol):
+    # Passes each new packet to handler(message) once. Repeats and anything older than the
+    # newest packet of its sender are dropped, statuses are latest-wins. on_gap() runs
+    # when packets went missing, the caller catches up over TCP.
+    def __init__(self, address: str, handler: Callable, on_gap: Callable = None):
+        self.group, self.port = parse_address(address)
+        self.handler = handler
+        self.on_gap = on_gap
+        self.transport: Union[asyncio.DatagramTransport, None] = None
+        # sender id -> newest sequence number
+        self.last_seq = {}
+        self.received = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.gaps = 0
+
+    async def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+        membership = struct.pack('4sl', socket.inet_aton(self.group), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setblocking(False)
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, sock=sock)
+
+    def datagram_received(self, data: bytes, address):
+        if len(data) < SENDER.size + HEADER.size:
+            return
+
+        sender, = SENDER.unpack_from(data)
+        magic, message_type, length, seq = HEADER.unpack_from(data, SENDER.size)
+        if magic != MAGIC or len(data) != SENDER.size + HEADER.size + length:
+            return
+
+        last = self.last_seq.get(sender)
+        if last is not None and seq <= last:
+            if seq == last:
+                self.duplicates += 1
+            else:
+                self.stale += 1
+            return
+
+        self.last_seq[sender] = seq
+        self.received += 1
+        if last is not None and seq > last + 1:
+            self.gaps += 1
+            if self.on_gap is not None:
+                self.on_gap()
+
+        if message_type != TYPE_HELLO:
+            self.handler(Message(message_type, seq, data[SENDER.size + HEADER.size:]))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'duplicates': self.duplicates, 'stale': self.stale, 'gaps': self.gaps}
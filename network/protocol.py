@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import struct
+from typing import Union
+
+# Binary frames start with a byte that never appears in the text protocol,
+# which lets the server tell old text clients from binary ones
+MAGIC = 0xA5
+# magic, message type, payload length, sequence number
+HEADER = struct.Struct('!BBHI')
+MAX_PAYLOAD = 0xFFFF
+
+PROTOCOL_BINARY = 'binary'
+PROTOCOL_TEXT = 'text'
+
+TYPE_HELLO = 1
+TYPE_STATUS = 2
+TYPE_ERROR = 3
+# live pixel stream, see network.stream
+TYPE_KEYFRAME = 4
+TYPE_DELTA = 5
+# clock offset exchange, see network.clock
+TYPE_PING = 6
+TYPE_PONG = 7
+# asks the server for the current status after missed multicast packets
+TYPE_SYNC = 8
+
+# a status may carry the wall clock time its playback started at
+STATUS_START = struct.Struct('!Bd')
+
+
+class Message:
+    type: int = 0
+    seq: int = 0
+    payload: bytes = b''
+
+    def __init__(self, message_type: int, seq: int = 0, payload: bytes = b''):
+        self.type = message_type
+        self.seq = seq
+        self.payload = payload
+
+    @property
+    def status(self) -> int:
+        if self.type != TYPE_STATUS or len(self.payload) not in (1, STATUS_START.size):
+            raise ValueError('Message is not a status')
+        return self.payload[0]
+
+    @property
+    def start_at(self) -> Union[float, None]:
+        if self.type != TYPE_STATUS or len(self.payload) != STATUS_START.size:
+            return None
+        return STATUS_START.unpack(self.payload)[1]
+
+    def __repr__(self):
+        return f'Message(type={self.type}, seq={self.seq}, payload={self.payload!r})'
+
+
+class Protocol:
+    binary: bool = True
+    # sequence number of the last message received
+    received_seq: int = 0
+    # bytes read ahead while detecting the protocol
+    pending: bytes = b''
+    # a text guess made before the client sent anything, its first byte can still make it binary
+    detected: bool = True
+
+    def __init__(self, binary: bool = True):
+        self.binary = binary
+        self.sequence = itertools.count(1)
+
+    def encode(self, message_type: int, payload: bytes = b'') -> bytes:
+        if not self.binary:
+            # text clients only understand plain statuses and error lines
+            if message_type == TYPE_STATUS:
+                return str(payload[0]).encode()
+            if message_type == TYPE_ERROR:
+                return payload + b'\n'
+            return b''
+
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError(f'Payload of {len(payload)} bytes does not fit in a frame')
+
+        return HEADER.pack(MAGIC, message_type, len(payload), next(self.sequence)) + payload
+
+    def encode_status(self, status: int, start_at: float = None) -> bytes:
+        if start_at is not None:
+            return self.encode(TYPE_STATUS, STATUS_START.pack(status, start_at))
+        return self.encode(TYPE_STATUS, bytes([status]))
+
+    def encode_error(self, error: str) -> bytes:
+        return self.encode(TYPE_ERROR, error.encode())
+
+    @staticmethod
+    def parse_text(data: bytes) -> Message:
+        return Message(TYPE_STATUS, 0, bytes([int(data.decode().strip())]))
+
+    async def read_frame(self, reader: asyncio.StreamReader, header: bytes) -> Message:
+        magic, message_type, length, seq = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('Invalid frame header')
+
+        payload = await reader.readexactly(length) if length else b''
+        self.received_seq = seq
+        return Message(message_type, seq, payload)
+
+    async def read(self, reader: asyncio.StreamReader) -> Union[Message, None]:
+        try:
+            if self.binary:
+                header = self.pending + await reader.readexactly(HEADER.size - len(self.pending))
+                self.pending = b''
+                return await self.read_frame(reader, header)
+
+            # text statuses are single digits, reading them one by one keeps "1" and "0"
+            # apart even when TCP delivers them together. Anything else, error lines of the
+            # other side included, is dropped without an answer, answering it would only
+            # be answered again.
+            while True:
+                char = self.pending or await reader.read(1)
+                self.pending = b''
+                if not char:
+                    return None
+                if not self.detected:
+                    self.detected = True
+                    if char[0] == MAGIC:
+                        self.binary = True
+                        self.pending = char
+                        return await self.read(reader)
+                if char.isdigit():
+                    return self.parse_text(char)
+        except asyncio.IncompleteReadError:
+            return None
+
+    @classmethod
+    async def accept(cls, reader: asyncio.StreamReader, timeout: float = 0.5) -> Union['Protocol', None]:
+        # picks the protocol from the first byte the client sends. Text clients stay quiet
+        # until the button is pressed, so after the timeout the client is taken for text.
+        try:
+            first = await asyncio.wait_for(reader.read(1), timeout)
+        except asyncio.TimeoutError:
+            protocol = cls(False)
+            protocol.detected = False
+            return protocol
+        if not first:
+            return None
+
+        protocol = cls(first[0] == MAGIC)
+        protocol.pending = first
+        return protocol
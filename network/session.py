@@ -0,0 +1,117 @@
+import asyncio
+import itertools
+from typing import Union
+
+from network.protocol import Protocol
+
+
+class Session:
+    id: int = 0
+    peer = None
+    status: int = -1
+
+    reader: asyncio.StreamReader = None
+    writer: asyncio.StreamWriter = None
+    protocol: Protocol = None
+    # bounded outbound queue of (message type, payload), a slow client only ever delays its own messages
+    queue: asyncio.Queue = None
+    sender: Union[asyncio.Task, None] = None
+
+    dropped: int = 0
+    sent: int = 0
+    writes: int = 0
+    closed: bool = False
+    # optional features the client announced in its hello
+    features: set = None
+
+    def __init__(self, session_id: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 protocol: Protocol, queue_size: int = 16, write_timeout: float = 10.0):
+        self.id = session_id
+        self.reader = reader
+        self.writer = writer
+        self.protocol = protocol
+        self.peer = writer.get_extra_info('peername')
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.write_timeout = write_timeout
+        self.features = set()
+
+    def start(self):
+        self.sender = asyncio.create_task(self.send_loop())
+
+    def send(self, message_type: int, payload: bytes = b'') -> bool:
+        if self.closed:
+            return False
+
+        if self.queue.full():
+            # status updates are latest-wins, so the oldest queued one is the cheapest to lose
+            self.queue.get_nowait()
+            self.dropped += 1
+
+        self.queue.put_nowait((message_type, payload))
+        return True
+
+    async def send_loop(self):
+        try:
+            while True:
+                messages = [await self.queue.get()]
+                # everything queued meanwhile goes out in the same write
+                while not self.queue.empty():
+                    messages.append(self.queue.get_nowait())
+
+                self.writer.write(b''.join(self.protocol.encode(*message) for message in messages))
+                await asyncio.wait_for(self.writer.drain(), self.write_timeout)
+                self.sent += len(messages)
+                self.writes += 1
+        except (asyncio.TimeoutError, ConnectionError):
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        if self.sender is not None and self.sender is not asyncio.current_task():
+            self.sender.cancel()
+        self.writer.close()
+
+
+class SessionHub:
+    sessions: dict = None
+    queue_size: int = 16
+    write_timeout: float = 10.0
+
+    def __init__(self, queue_size: int = 16, write_timeout: float = 10.0):
+        self.sessions = {}
+        self.queue_size = queue_size
+        self.write_timeout = write_timeout
+        self.ids = itertools.count(1)
+
+    def register(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, protocol: Protocol) -> Session:
+        session = Session(next(self.ids), reader, writer, protocol, self.queue_size, self.write_timeout)
+        self.sessions[session.id] = session
+        session.start()
+        return session
+
+    def unregister(self, session: Session):
+        self.sessions.pop(session.id, None)
+        session.close()
+
+    def send(self, session_id: int, message_type: int, payload: bytes = b'') -> bool:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return False
+        return session.send(message_type, payload)
+
+    def broadcast(self, message_type: int, payload: bytes = b'', exclude: Session = None) -> int:
+        sent = 0
+        for session in list(self.sessions.values()):
+            if session is not exclude and session.send(message_type, payload):
+                sent += 1
+        return sent
+
+    def stats(self) -> dict:
+        return {
+            'sessions': len(self.sessions),
+            'queued': sum(session.queue.qsize() for session in self.sessions.values()),
+            'dropped': sum(session.dropped for session in self.sessions.values()),
+        }
@@ -0,0 +1,224 @@
+import struct
+import time
+from typing import Union
+
+import numpy as np
+
+from network.protocol import MAX_PAYLOAD, TYPE_DELTA, TYPE_KEYFRAME
+
+# frame number, strip index in led.ini order, pixel count of a keyframe or run count of a delta
+FRAME = struct.Struct('!IBH')
+# first pixel and length of a run of changed pixels
+RUN = struct.Struct('!HH')
+# runs closer than this are sent as one, a run header costs more than a pixel
+MERGE_GAP = 2
+
+
+def to_rgb(frame: np.ndarray) -> bytes:
+    # packed 0x00RRGGBB pixels as RGB bytes
+    return frame.astype('>u4').view(np.uint8).reshape(-1, 4)[:, 1:].tobytes()
+
+
+def from_rgb(data: bytes) -> np.ndarray:
+    rgb = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+
+def changed_runs(previous: np.ndarray, frame: np.ndarray) -> list:
+    changed = np.flatnonzero(previous != frame)
+    if not len(changed):
+        return []
+
+    # a new run starts wherever the gap to the previous changed pixel is too wide
+    breaks = np.flatnonzero(np.diff(changed) > MERGE_GAP + 1) + 1
+    starts = changed[np.concatenate(([0], breaks))]
+    stops = changed[np.concatenate((breaks - 1, [len(changed) - 1]))] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+class FrameEncoder:
+    # Encodes one stream of frames per strip. Every frame is encoded once and the
+    # same payload goes to all clients that are in sync.
+    keyframe_interval: int = 60
+
+    def __init__(self, keyframe_interval: int = 60):
+        self.keyframe_interval = keyframe_interval
+        self.frames = {}
+        self.frame_number = 0
+
+    def encode(self, strip: int, frame: np.ndarray) -> tuple:
+        # returns (keyframe payload, delta payload or None) of the next frame
+        previous = self.frames.get(strip)
+        self.frames[strip] = frame.copy()
+        keyframe = FRAME.pack(self.frame_number, strip, len(frame)) + to_rgb(frame)
+        if len(keyframe) > MAX_PAYLOAD:
+            raise ValueError(f'Strip {strip} has too many pixels for one frame')
+
+        if previous is None or len(previous) != len(frame) or self.frame_number % self.keyframe_interval == 0:
+            return keyframe, None
+
+        runs = changed_runs(previous, frame)
+        delta = FRAME.pack(self.frame_number, strip, len(runs)) + b''.join(
+            RUN.pack(start, stop - start) + to_rgb(frame[start:stop]) for start, stop in runs)
+        if len(delta) >= len(keyframe):
+            return keyframe, None
+        return keyframe, delta
+
+    def next_frame(self):
+        self.frame_number = (self.frame_number + 1) & 0xFFFFFFFF
+
+
+class FrameStream:
+    # Sends frames to the subscribed sessions of a SessionHub. Sessions that started
+    # their video together form a group and get the same frames, encoded once per
+    # group. A session whose outbound queue is backed up skips frames and gets a
+    # keyframe once it caught up, so a slow client never makes the stream queue up.
+    def __init__(self, hub, keyframe_interval: int = 60, max_backlog: int = 1):
+        self.hub = hub
+        self.keyframe_interval = keyframe_interval
+        self.max_backlog = max_backlog
+        # group -> FrameEncoder, frame numbers are shared so a session can change groups
+        self.encoders = {}
+        self.frame_number = 0
+        self.published = set()
+        self.subscribers = set()
+        # session id -> group of the last frame it got
+        self.groups = {}
+        # sessions that missed a frame and need a keyframe next
+        self.behind = set()
+        self.sent = 0
+        self.skipped = 0
+
+    def subscribe(self, session_id: int):
+        self.subscribers.add(session_id)
+        self.behind.add(session_id)
+
+    def unsubscribe(self, session_id: int):
+        self.subscribers.discard(session_id)
+        self.groups.pop(session_id, None)
+        self.behind.discard(session_id)
+
+    def publish(self, frames: list, session_ids: set, group=None) -> int:
+        # frames holds the packed pixels of every strip in led.ini order, sent to the
+        # subscribers among session_ids
+        encoder = self.encoders.get(group)
+        if encoder is None:
+            encoder = self.encoders[group] = FrameEncoder(self.keyframe_interval)
+        encoder.frame_number = self.frame_number
+        encoded = [encoder.encode(strip, frame) for strip, frame in enumerate(frames)]
+        self.published.add(group)
+
+        sent = 0
+        for session_id in session_ids & self.subscribers:
+            session = self.hub.sessions.get(session_id)
+            if session is None:
+                self.unsubscribe(session_id)
+                continue
+
+            if session.queue.qsize() > self.max_backlog:
+                self.behind.add(session_id)
+                self.skipped += 1
+                continue
+
+            # the deltas of another group do not follow what the session shows
+            keyframe = session_id in self.behind or self.groups.get(session_id, group) != group
+            for keyframe_payload, delta_payload in encoded:
+                if keyframe or delta_payload is None:
+                    session.send(TYPE_KEYFRAME, keyframe_payload)
+                else:
+                    session.send(TYPE_DELTA, delta_payload)
+            self.groups[session_id] = group
+            self.behind.discard(session_id)
+            sent += 1
+
+        self.sent += sent
+        return sent
+
+    def next_frame(self):
+        # a group that got no frame this tick has ended, its deltas would not follow
+        self.encoders = {group: encoder for group, encoder in self.encoders.items() if group in self.published}
+        self.published = set()
+        self.frame_number = (self.frame_number + 1) & 0xFFFFFFFF
+
+
+class FrameDecoder:
+    # Applies keyframes and deltas straight into the strip buffers. Deltas that do not
+    # follow the last applied frame of their strip are dropped until the next keyframe.
+    # Several frames applied between two ticks are pushed once, the older ones never show.
+    timeout: float = 1.0
+
+    def __init__(self, timeout: float = 1.0):
+        self.timeout = timeout
+        # strip index -> last applied frame number, missing while waiting for a keyframe
+        self.frames = {}
+        self.received = 0
+        self.received_at: Union[float, None] = None
+        self.dropped = 0
+
+    def reset(self):
+        # frame numbers start over with every connection
+        self.frames = {}
+
+    @staticmethod
+    def strip(index: int, strips: dict):
+        strips = list(strips.values())
+        return strips[index] if index < len(strips) else None
+
+    def stale(self, index: int, frame_number: int) -> bool:
+        last = self.frames.get(index)
+        # frame numbers wrap, anything up to half the range behind is old
+        return last is not None and 0 < (last - frame_number) & 0xFFFFFFFF < 0x80000000
+
+    def apply(self, message_type: int, payload: bytes, strips: dict) -> bool:
+        if len(payload) < FRAME.size:
+            self.dropped += 1
+            return False
+
+        frame_number, index, count = FRAME.unpack_from(payload)
+        strip = self.strip(index, strips)
+        if strip is None or self.stale(index, frame_number):
+            self.dropped += 1
+            return False
+
+        try:
+            if message_type == TYPE_KEYFRAME:
+                if len(payload) != FRAME.size + count * 3:
+                    raise ValueError(f'Keyframe of {count} pixels has {len(payload) - FRAME.size} bytes')
+                pixels = min(count, strip.count)
+                strip.frame[:pixels] = from_rgb(payload[FRAME.size:FRAME.size + pixels * 3])
+            elif self.frames.get(index) != (frame_number - 1) & 0xFFFFFFFF:
+                self.frames.pop(index, None)
+                self.dropped += 1
+                return False
+            else:
+                self.apply_runs(payload, count, strip)
+        except (struct.error, ValueError):
+            # a broken frame may have changed part of the strip, only a keyframe repairs it
+            self.frames.pop(index, None)
+            self.dropped += 1
+            return False
+
+        self.frames[index] = frame_number
+        self.received += 1
+        self.received_at = time.monotonic()
+        return True
+
+    @staticmethod
+    def apply_runs(payload: bytes, count: int, strip):
+        offset = FRAME.size
+        for _ in range(count):
+            start, length = RUN.unpack_from(payload, offset)
+            offset += RUN.size
+            if len(payload) < offset + length * 3:
+                raise ValueError(f'Run of {length} pixels is cut off')
+            stop = min(start + length, strip.count)
+            if stop > start:
+                strip.frame[start:stop] = from_rgb(payload[offset:offset + (stop - start) * 3])
+            offset += length * 3
+        if offset != len(payload):
+            raise ValueError(f'Delta has {len(payload) - offset} bytes past its runs')
+
+    @property
+    def active(self) -> bool:
+        # the animation takes over again once the stream went quiet
+        return self.received_at is not None and time.monotonic() - self.received_at < self.timeout
@@ -0,0 +1,106 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Union
+
+
+class Timer:
+    deadline: float = 0
+    key = None
+    callback: Callable = None
+    cancelled: bool = False
+
+    def __init__(self, deadline: float, seq: int, key, callback: Callable):
+        self.deadline = deadline
+        self.seq = seq
+        self.key = key
+        self.callback = callback
+
+    def __lt__(self, other: 'Timer') -> bool:
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class TimerQueue:
+    # One heap for all pending timers, keyed so every key has at most one, and a single
+    # coroutine firing them. Cancelled and replaced timers stay in the heap until they
+    # reach the top or the heap gets compacted.
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.heap = []
+        self.timers = {}
+        self.sequence = itertools.count()
+        self.changed = asyncio.Event()
+        self.fired = 0
+        self.cancelled = 0
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key) -> bool:
+        return key in self.timers
+
+    def schedule(self, key, deadline: float, callback: Callable) -> Timer:
+        # replaces a pending timer of the same key
+        self.discard(key)
+        timer = Timer(deadline, next(self.sequence), key, callback)
+        self.timers[key] = timer
+        heapq.heappush(self.heap, timer)
+        if self.heap[0] is timer:
+            # the runner sleeps until an older deadline
+            self.changed.set()
+        return timer
+
+    def cancel(self, key) -> bool:
+        if not self.discard(key):
+            return False
+        self.cancelled += 1
+        return True
+
+    def discard(self, key) -> bool:
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+
+        timer.cancelled = True
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.timers):
+            self.heap = [timer for timer in self.heap if not timer.cancelled]
+            heapq.heapify(self.heap)
+        return True
+
+    def deadline(self, key) -> Union[float, None]:
+        timer = self.timers.get(key)
+        return None if timer is None else timer.deadline
+
+    def upcoming(self, limit: int = 10) -> list:
+        # (deadline, key) of the next timers to fire
+        return [(timer.deadline, timer.key) for timer in heapq.nsmallest(limit, self.timers.values())]
+
+    def fire_due(self) -> Union[float, None]:
+        # runs every due timer and returns the next deadline
+        while self.heap:
+            timer = self.heap[0]
+            if timer.cancelled:
+                heapq.heappop(self.heap)
+                continue
+            if timer.deadline > self.clock():
+                return timer.deadline
+
+            heapq.heappop(self.heap)
+            del self.timers[timer.key]
+            self.fired += 1
+            timer.callback()
+        return None
+
+    async def run(self):
+        while True:
+            self.changed.clear()
+            deadline = self.fire_due()
+            timeout = None if deadline is None else max(deadline - self.clock(), 0)
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {'pending': len(self.timers), 'heap': len(self.heap), 'fired': self.fired, 'cancelled': self.cancelled}
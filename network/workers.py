@@ -0,0 +1,166 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import time
+from typing import Callable, Union
+
+from network.protocol import Protocol
+
+LOOP_ASYNCIO = 'asyncio'
+LOOP_UVLOOP = 'uvloop'
+LOOPS = [LOOP_ASYNCIO, LOOP_UVLOOP]
+
+
+def install_event_loop(name: str = LOOP_ASYNCIO) -> str:
+    # uvloop is optional, without it the standard loop is used
+    if name not in LOOPS:
+        raise AttributeError(f'Unknown event loop "{name}"')
+
+    if name == LOOP_UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            print('uvloop is not installed, using the asyncio event loop')
+            return LOOP_ASYNCIO
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return name
+
+
+def reuseport_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    # every worker binds its own listening socket, the kernel spreads new connections over them
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def worker_address(address: str, worker: int) -> str:
+    # metrics endpoints and trace files of the workers must not collide
+    if address.startswith('unix:') or ':' not in address:
+        return f'{address}.{worker}'
+    host, port = address.rsplit(':', 1)
+    return f'{host}:{int(port) + worker}'
+
+
+class Coordinator:
+    # Runs in the parent process and relays every message a worker sends to all the
+    # other workers, so a broadcast reaches clients held by any worker.
+    def __init__(self, path: str):
+        self.path = path
+        self.writers = set()
+        self.protocol = Protocol(True)
+        self.relayed = 0
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle_worker, self.path)
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        protocol = Protocol(True)
+        self.writers.add(writer)
+        try:
+            while True:
+                message = await protocol.read(reader)
+                if message is None:
+                    break
+
+                frame = self.protocol.encode(message.type, message.payload)
+                for other in list(self.writers):
+                    if other is not writer:
+                        other.write(frame)
+                self.relayed += 1
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            # cancelled when the parent shuts down
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def close(self):
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+
+
+class CoordinatorLink:
+    # A worker's connection to the coordinator
+    writer: Union[asyncio.StreamWriter, None] = None
+
+    def __init__(self, path: str, handler: Callable):
+        self.path = path
+        self.handler = handler
+        self.protocol = Protocol(True)
+
+    async def connect(self, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+
+    def send(self, message_type: int, payload: bytes = b''):
+        if self.writer is not None:
+            self.writer.write(self.protocol.encode(message_type, payload))
+
+    async def run(self):
+        while True:
+            message = await self.protocol.read(self.reader)
+            if message is None:
+                print('Coordinator connection lost')
+                return
+            self.handler(message)
+
+
+async def supervise(count: int, target: Callable, args: tuple):
+    with tempfile.TemporaryDirectory() as directory:
+        coordinator = Coordinator(os.path.join(directory, 'coordinator.sock'))
+        await coordinator.start()
+
+        # spawned workers start from a clean interpreter instead of a fork of this running loop
+        context = multiprocessing.get_context('spawn')
+
+        def spawn(index: int) -> multiprocessing.Process:
+            process = context.Process(target=target, args=(index, coordinator.path) + args, daemon=True)
+            process.start()
+            return process
+
+        stopping = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+        processes = [spawn(index) for index in range(count)]
+        print(f'Started {count} workers')
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(stopping.wait(), 1)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                for index, process in enumerate(processes):
+                    if not process.is_alive():
+                        print(f'Worker {index} exited with {process.exitcode}, restarting')
+                        processes[index] = spawn(index)
+        finally:
+            coordinator.close()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+
+def run_workers(count: int, target: Callable, *args):
+    # target(index, coordinator path, *args) runs one worker process
+    try:
+        asyncio.run(supervise(count, target, args))
+    except KeyboardInterrupt:
+        pass
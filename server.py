@@ -1,15 +1,72 @@
 #!/usr/bin/env python3
 
+import argparse
 import asyncio
 import os
-import random
+import time
 from configparser import ConfigParser
+from typing import Union
+
+from led_strip.playback import ShowFile
+from led_strip.scheduler import FrameScheduler
+from network.clock import PING, pong_payload
+from network.multicast import MulticastSender
+from network.protocol import Protocol, STATUS_START, TYPE_ERROR, TYPE_HELLO, TYPE_PING, TYPE_PONG, TYPE_STATUS, \
+    TYPE_SYNC
+from network.session import Session, SessionHub
+from network.stream import FrameStream
+from network.timers import TimerQueue
+from network.workers import CoordinatorLink, LOOP_ASYNCIO, LOOPS, install_event_loop, reuseport_socket, run_workers, \
+    worker_address
+from service.metrics import LoopLagMonitor, MetricsServer, Registry
+from service.trace import install_dump_handlers, tracer
+
+STATUS_IDLE = 0
+STATUS_VIDEO = 1
+STATUSES = {
+    0: "idle",
+    1: "video"
+}
+
 
 class Server:
     config: ConfigParser = None
-    writer: asyncio.StreamWriter = None
+    hub: SessionHub = None
+
+    video_length: float = 20
+    queue_size: int = 16
+    write_timeout: float = 10
+    debug: bool = False
+
+    # end of the running playback per session id
+    playbacks: TimerQueue = None
+    # a press starts the video on every connected heart at the same moment
+    sync_group: bool = False
+    # group videos start this long after the press, enough for every heart to get the start time
+    start_delay: float = 0.25
+
+    # show file streamed live to subscribed clients while a video plays
+    stream_file: str = None
+    stream: FrameStream = None
 
-    def __init__(self, config: str):
+    # host:port or unix:/path for the Prometheus metrics endpoint
+    metrics_address: str = None
+    metrics: Registry = None
+    connections = None
+    transitions = None
+
+    # worker processes sharing the port, see network.workers
+    workers: int = 1
+    worker: Union[int, None] = None
+    loop: str = LOOP_ASYNCIO
+    # relays group starts to the other workers
+    peers: Union[CoordinatorLink, None] = None
+
+    # group:port for status broadcasts over UDP, the TCP connections stay for acks and catch-up
+    multicast_address: str = None
+    multicast: Union[MulticastSender, None] = None
+
+    def __init__(self, config: str, worker: int = None):
         if config is None:
             raise AttributeError('Server config cannot be null')
 
@@ -22,40 +79,301 @@ class Server:
         if 'port' not in self.config['server']:
             raise AttributeError('Server section must contain key "port"')
 
+        for field in ['video_length', 'write_timeout', 'start_delay']:
+            if field in self.config['server']:
+                setattr(self, field, float(self.config['server'][field]))
+
+        if 'queue_size' in self.config['server']:
+            self.queue_size = int(self.config['server']['queue_size'])
+
+        self.worker = worker
+        self.workers = int(self.config['server'].get('workers', self.workers))
+        self.loop = self.config['server'].get('loop', self.loop)
+
+        if 'trace' in self.config['server'] and not tracer.enabled:
+            trace = self.config['server']['trace']
+            tracer.start(trace if worker is None else worker_address(trace, worker))
+
+        if 'metrics' in self.config['server']:
+            self.metrics_address = self.config['server']['metrics']
+            if worker is not None:
+                self.metrics_address = worker_address(self.metrics_address, worker)
+
+        if 'debug' in self.config['server']:
+            self.debug = True if int(self.config['server']['debug']) > 0 else False
+
+        if 'sync_group' in self.config['server']:
+            self.sync_group = True if int(self.config['server']['sync_group']) > 0 else False
+
+        if 'multicast' in self.config['server']:
+            self.multicast_address = self.config['server']['multicast']
+            self.multicast = MulticastSender(self.multicast_address,
+                                             int(self.config['server'].get('multicast_ttl', 1)),
+                                             int(self.config['server'].get('multicast_repeats', 2)))
+
+        self.hub = SessionHub(self.queue_size, self.write_timeout)
+        self.playbacks = TimerQueue()
+
+        if 'stream' in self.config['server']:
+            self.stream_file = self.config['server']['stream']
+            self.stream = FrameStream(self.hub, int(self.config['server'].get('stream_keyframes', 60)))
+
+    async def start_metrics(self) -> MetricsServer:
+        self.metrics = Registry()
+        self.connections = self.metrics.counter('heart_server_connections_total', 'Accepted client connections')
+        self.transitions = self.metrics.counter('heart_status_transitions_total', 'Statuses received by status')
+        self.metrics.gauge('heart_server_sessions', 'Connected clients', lambda: len(self.hub.sessions))
+        self.metrics.gauge('heart_server_playbacks', 'Running video playbacks', lambda: len(self.playbacks))
+        self.metrics.gauge('heart_server_next_playback_end_seconds', 'Time until the next video ends',
+                           self.next_playback_end)
+        self.metrics.counter('heart_server_messages_dropped_total', 'Messages dropped from full client queues',
+                             lambda: self.hub.stats()['dropped'])
+        self.metrics.gauge('heart_session_queue_depth', 'Queued outbound messages per client', self.queue_depths)
+        if self.stream is not None:
+            self.metrics.counter('heart_stream_frames_sent_total', 'Frames streamed to clients',
+                                 lambda: self.stream.sent)
+            self.metrics.counter('heart_stream_frames_skipped_total', 'Frames skipped for backed up clients',
+                                 lambda: self.stream.skipped)
+
+        metrics_server = MetricsServer(self.metrics, self.metrics_address)
+        await metrics_server.start()
+        print(f'Metrics on {self.metrics_address}')
+        return metrics_server
+
+    def queue_depths(self) -> dict:
+        return {(('session', session.id), ('peer', ':'.join(map(str, session.peer[:2])))): session.queue.qsize()
+                for session in self.hub.sessions.values()}
+
+    def send_status(self, session_id: int, status: int) -> bool:
+        return self.hub.send(session_id, TYPE_STATUS, bytes([status]))
+
+    def broadcast_status(self, status: int, exclude: Session = None) -> int:
+        return self.hub.broadcast(TYPE_STATUS, bytes([status]), exclude)
+
+    def end_playback(self, session: Session):
+        print(f"Send: {STATUS_IDLE!r} to {session.peer!r}")
+        self.send_status(session.id, STATUS_IDLE)
+
+    def start_playback(self, session: Session, start_at: float, notify: bool = True):
+        # a press during a running video extends it to a full video from the new start
+        if session.id in self.playbacks:
+            print(f"Extending video for {session.peer!r} by "
+                  f"{start_at + self.video_length - self.playbacks.deadline(session.id):.1f} seconds...")
+        else:
+            print(f"Playing video for {session.peer!r}, {self.video_length} seconds...")
+        self.playbacks.schedule(session.id, start_at + self.video_length, lambda: self.end_playback(session))
+        if notify and session.protocol.binary:
+            # binary clients position their animation from the common start in server time
+            session.send(TYPE_STATUS, STATUS_START.pack(STATUS_VIDEO, start_at))
+
+    async def stream_show(self):
+        # plays the show file to every subscribed session with a running video, from its own start
+        show = ShowFile(self.stream_file)
+        scheduler = FrameScheduler(show.fps)
+        print(f'Streaming {self.stream_file}, {show.frames} frames at {show.fps:g} fps')
+        try:
+            while True:
+                await scheduler.wait()
+                now = time.time()
+                groups = {}
+                for session_id in self.stream.subscribers:
+                    deadline = self.playbacks.deadline(session_id)
+                    # only hearts playing their video, a synced start still ahead keeps the animation
+                    if deadline is not None and deadline - self.video_length <= now:
+                        groups.setdefault(deadline - self.video_length, set()).add(session_id)
+
+                for start_at, session_ids in groups.items():
+                    self.stream.publish(show.strip_frames(show.frame_index(now - start_at)), session_ids, start_at)
+                self.stream.next_frame()
+        finally:
+            show.close()
+
+    def stop_playback(self, session: Session):
+        self.playbacks.cancel(session.id)
+
+    def upcoming(self, limit: int = 10) -> list:
+        # (seconds left, session id, peer) of the next videos to end
+        now = time.time()
+        return [(deadline - now, session_id, self.hub.sessions[session_id].peer)
+                for deadline, session_id in self.playbacks.upcoming(limit) if session_id in self.hub.sessions]
+
+    def next_playback_end(self) -> float:
+        upcoming = self.playbacks.upcoming(1)
+        return max(upcoming[0][0] - time.time(), 0) if upcoming else 0
+
+    def handle_message(self, session: Session, message):
+        if message.type == TYPE_PING:
+            if len(message.payload) != PING.size:
+                session.send(TYPE_ERROR, b'Invalid ping')
+                return
+            session.send(TYPE_PONG, pong_payload(message.payload, time.time()))
+            return
+        elif message.type == TYPE_HELLO:
+            session.features = set(message.payload.split(b','))
+            if b'stream' in session.features and self.stream is not None:
+                self.stream.subscribe(session.id)
+            return
+        elif message.type == TYPE_SYNC:
+            self.send_current_status(session)
+            return
+        elif message.type != TYPE_STATUS:
+            session.send(TYPE_ERROR, f'Unknown message type {message.type}'.encode())
+            return
+
+        print(f"Received {message.status!r} from {session.peer!r}")
+        session.status = message.status
+        if self.transitions is not None:
+            self.transitions.inc(status=STATUSES.get(message.status, message.status))
+
+        if message.status == STATUS_VIDEO:
+            # a single heart already lights up on the press, its start time only needs to be confirmed
+            start_at = time.time() + (self.start_delay if self.sync_group else 0)
+            if self.sync_group:
+                self.start_group(start_at, session, True)
+                if self.peers is not None:
+                    self.peers.send(TYPE_STATUS, STATUS_START.pack(STATUS_VIDEO, start_at))
+            else:
+                self.start_playback(session, start_at)
+            if self.debug:
+                print(f'Upcoming video ends: {self.upcoming(5)}, timers {self.playbacks.stats()}')
+        else:
+            self.stop_playback(session)
+
+    def start_group(self, start_at: float, origin: Session = None, announce: bool = False):
+        # the worker the press came in on multicasts the start once for every listening client
+        if announce and self.multicast is not None:
+            self.multicast.send(TYPE_STATUS, STATUS_START.pack(STATUS_VIDEO, start_at))
+
+        for session in list(self.hub.sessions.values()):
+            listens = self.multicast is not None and b'multicast' in session.features
+            self.start_playback(session, start_at, session is origin or not listens)
+            if session is not origin and not session.protocol.binary:
+                self.send_status(session.id, STATUS_VIDEO)
+
+    def send_current_status(self, session: Session):
+        # catch-up for a client that missed multicast packets
+        deadline = self.playbacks.deadline(session.id)
+        if deadline is None:
+            self.send_status(session.id, STATUS_IDLE)
+        else:
+            session.send(TYPE_STATUS, STATUS_START.pack(STATUS_VIDEO, deadline - self.video_length))
+
+    def handle_peer_message(self, message):
+        # a group start from a client of another worker
+        if message.type == TYPE_STATUS and message.start_at is not None:
+            self.start_group(message.start_at)
+
     async def handle_echo(self, reader, writer):
-        self.writer = writer
-        while True:
-            data = await reader.read(100)
-            try:
-                message = int(data.decode().strip())
-            except ValueError:
-                self.writer.write('Invalid int argument\n')
-                self.writer.close()
+        protocol = await Protocol.accept(reader)
+        if protocol is None:
+            writer.close()
+            return
 
-            addr = self.writer.get_extra_info('peername')
+        session = self.hub.register(reader, writer, protocol)
+        if self.connections is not None:
+            self.connections.inc()
+        if self.debug:
+            print(f"Connected {session.peer!r} ({'binary' if protocol.binary else 'text'}), "
+                  f"{len(self.hub.sessions)} sessions")
 
-            print(f"Received {message!r} from {addr!r}")
+        try:
+            while True:
+                try:
+                    message = await protocol.read(reader)
+                except ValueError:
+                    # the client sent a broken frame, its next header cannot be found, so drop it
+                    session.send(TYPE_ERROR, b'Invalid frame')
+                    break
 
-            print("Sleeping 20 seconds...")
-            await asyncio.sleep(20)
+                if message is None:
+                    break
 
-            print(f"Send: {message!r}")
-            self.writer.write("0".encode())
-            await self.writer.drain()
+                with tracer.span('Server.handle_echo'):
+                    try:
+                        self.handle_message(session, message)
+                    except ValueError as e:
+                        # a well framed message with a broken payload, the stream is still in sync
+                        session.send(TYPE_ERROR, f'Invalid message: {e}'.encode())
+        except ConnectionError:
+            pass
+        finally:
+            self.stop_playback(session)
+            if self.stream is not None:
+                self.stream.unsubscribe(session.id)
+            self.hub.unregister(session)
+            if self.debug:
+                print(f"Disconnected {session.peer!r}, {len(self.hub.sessions)} sessions")
 
-async def main(server):
-    server_task = await asyncio.start_server(
-        server.handle_echo, server.config['server']['host'], int(server.config['server']['port']))
+async def main(server, sock=None, coordinator: str = None):
+    if sock is not None:
+        server_task = await asyncio.start_server(server.handle_echo, sock=sock)
+    else:
+        server_task = await asyncio.start_server(
+            server.handle_echo, server.config['server']['host'], int(server.config['server']['port']),
+            backlog=1024)
 
     addr = server_task.sockets[0].getsockname()
-    print(f'Serving on {addr}')
+    print(f'Serving on {addr}' + (f' in worker {server.worker}' if server.worker is not None else ''))
+
+    if coordinator is not None:
+        server.peers = CoordinatorLink(coordinator, server.handle_peer_message)
+        await server.peers.connect()
+        # a worker goes down together with the parent process relaying for it
+        asyncio.create_task(server.peers.run()).add_done_callback(lambda task: server_task.close())
+
+    if tracer.enabled:
+        install_dump_handlers()
+
+    if server.metrics_address:
+        await server.start_metrics()
+        asyncio.create_task(LoopLagMonitor(server.metrics).run())
+
+    asyncio.create_task(server.playbacks.run())
+    if server.multicast is not None:
+        await server.multicast.start()
+        asyncio.create_task(server.multicast.beacon())
+        print(f'Multicasting to {server.multicast_address}')
+    if server.stream is not None:
+        asyncio.create_task(server.stream_show())
 
     async with server_task:
         await server_task.serve_forever()
 
-if __name__ == '__main__':
-    server = Server(f"{os.getcwd()}/server.ini")
+def run_worker(worker: int, coordinator: str, config: str, loop: str, trace: str = None):
+    if trace:
+        tracer.start(worker_address(trace, worker))
+
+    server = Server(config, worker)
+    install_event_loop(loop or server.loop)
+    sock = reuseport_socket(server.config['server']['host'], int(server.config['server']['port']))
     try:
-        asyncio.run(main(server))
-    except KeyboardInterrupt:
-        asyncio.new_event_loop()
\ No newline at end of file
+        asyncio.run(main(server, sock, coordinator))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        if tracer.enabled:
+            tracer.dump()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Heart server')
+    parser.add_argument('--trace', help='record a Chrome trace, written on SIGUSR1 and on exit')
+    parser.add_argument('--workers', type=int, help='worker processes sharing the port, [server] workers')
+    parser.add_argument('--loop', choices=LOOPS, help='event loop implementation, [server] loop')
+    args = parser.parse_args()
+
+    config = f"{os.getcwd()}/server.ini"
+    server = Server(config)
+    workers = args.workers or server.workers
+    if workers > 1:
+        run_workers(workers, run_worker, config, args.loop, args.trace)
+    else:
+        if args.trace:
+            tracer.start(args.trace)
+        install_event_loop(args.loop or server.loop)
+        try:
+            asyncio.run(main(server))
+        except KeyboardInterrupt:
+            asyncio.new_event_loop()
+        finally:
+            if tracer.enabled:
+                tracer.dump()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+from configparser import ConfigParser
+
+
+def read_sections(path: str) -> dict:
+    config = ConfigParser()
+    config.read(path)
+    return {section: dict(config[section]) for section in config.sections()}
+
+
+def changed_sections(old: dict, new: dict) -> set:
+    return {section for section in set(old) | set(new) if old.get(section) != new.get(section)}
+
+
+class ConfigWatcher:
+    # Polls file modification times, so it needs nothing beyond the standard library
+    interval: float = 2.0
+    files: dict = None
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self.files = {}
+
+    def watch(self, path: str, callback):
+        # callback(changed_sections) is awaited when the file content changes
+        self.files[path] = {
+            'callback': callback,
+            'mtime': self.mtime(path),
+            'sections': read_sections(path),
+        }
+
+    @staticmethod
+    def mtime(path: str) -> float:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return 0.0
+
+    async def check(self) -> dict:
+        changes = {}
+        for path, watched in self.files.items():
+            mtime = self.mtime(path)
+            if mtime == watched['mtime']:
+                continue
+            watched['mtime'] = mtime
+
+            sections = read_sections(path)
+            changed = changed_sections(watched['sections'], sections)
+            watched['sections'] = sections
+            if changed:
+                changes[path] = changed
+                await watched['callback'](changed)
+        return changes
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                # a half written or broken file must not take the client down
+                print(f'Config reload failed with status {e}')
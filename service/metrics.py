@@ -0,0 +1,181 @@
+import asyncio
+import bisect
+import threading
+import time
+from typing import Union
+
+# seconds, spread for frame times and pushes of a few milliseconds as well as network latencies
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                       for key, value in labels)
+    return '{%s}' % escaped
+
+
+class Metric:
+    type = 'untyped'
+    name: str = ''
+    help: str = ''
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+
+    def samples(self) -> list:
+        return []
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(labels)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, callback=None):
+        super().__init__(name, help)
+        self.values = {}
+        self.callback = callback
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        values = self.values
+        if self.callback is not None:
+            # a callback returns a plain value, or a dict of label tuples to values
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [('', labels, value) for labels, value in values.items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # observed from the output threads as well as the event loop
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self) -> list:
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            samples.append(('_bucket', (('le', bound),), cumulative))
+        samples.append(('_bucket', (('le', '+Inf'),), count))
+        samples.append(('_sum', (), total))
+        samples.append(('_count', (), count))
+        return samples
+
+
+class Registry:
+    metrics: dict = None
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, callback=None) -> Counter:
+        return self.add(Counter(name, help, callback))
+
+    def gauge(self, name: str, help: str, callback=None) -> Gauge:
+        return self.add(Gauge(name, help, callback))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class LoopLagMonitor:
+    # how late the event loop wakes up a sleeping task, a direct measure of blocking calls
+    interval: float = 0.5
+    histogram: Histogram = None
+
+    def __init__(self, registry: Registry, interval: float = 0.5):
+        self.interval = interval
+        self.histogram = registry.histogram('heart_event_loop_lag_seconds', 'Event loop wake up delay')
+
+    async def run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(0.0, time.monotonic() - start - self.interval))
+
+
+class MetricsServer:
+    # Serves the registry in Prometheus text format on host:port or unix:/path
+    registry: Registry = None
+    address: str = None
+    server: Union[asyncio.AbstractServer, None] = None
+
+    def __init__(self, registry: Registry, address: str):
+        self.registry = registry
+        self.address = address
+
+    async def start(self):
+        if self.address.startswith('unix:'):
+            self.server = await asyncio.start_unix_server(self.handle, self.address[len('unix:'):])
+        else:
+            host, _, port = self.address.rpartition(':')
+            self.server = await asyncio.start_server(self.handle, host or '127.0.0.1', int(port))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # the request itself does not matter, every path returns the metrics
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+
+            body = self.registry.render().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
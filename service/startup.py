@@ -0,0 +1,88 @@
+import os
+import socket
+import time
+from typing import Union
+
+try:
+    # seconds since power-on including suspend, the closest thing to boot-to-light time
+    BOOT_CLOCK = time.CLOCK_BOOTTIME
+except AttributeError:
+    BOOT_CLOCK = None
+
+
+def process_started() -> Union[float, None]:
+    # seconds after boot the kernel started this process, from /proc/self/stat
+    try:
+        with open('/proc/self/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        return int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def notify(*states: str) -> bool:
+    # systemd sd_notify() without libsystemd, a no-op when not started by a Type=notify unit
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+
+    if address.startswith('@'):
+        # abstract socket namespace
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto('\n'.join(states).encode(), address)
+    except OSError as e:
+        print(f'Startup: systemd notification failed with status {e}')
+        return False
+    return True
+
+
+class StartupTimer:
+    # Time of every startup phase since the process began, logged once the client is ready
+    started: float = 0.0
+    # seconds after boot the process began, None where the boot clock is missing
+    booted: Union[float, None] = None
+    last: float = 0.0
+    phases: list = None
+    ready: bool = False
+    # seconds from start to the first server connection
+    connected: Union[float, None] = None
+
+    def __init__(self):
+        self.last = time.monotonic()
+        self.started = self.last
+        self.phases = []
+
+        spawned = process_started()
+        if BOOT_CLOCK is not None and spawned is not None:
+            # the interpreter started up before this module could take the time
+            interpreter = max(time.clock_gettime(BOOT_CLOCK) - spawned, 0.0)
+            self.booted = spawned
+            self.started -= interpreter
+            self.phases.append(('interpreter', interpreter))
+
+    def mark(self, name: str) -> float:
+        # the phase called name ends now and the next one begins
+        now = time.monotonic()
+        self.phases.append((name, now - self.last))
+        self.last = now
+        return now - self.started
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def report(self) -> str:
+        phases = ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in self.phases)
+        line = f'Startup: {phases}, total {self.elapsed() * 1000:.1f} ms'
+        if self.booted is not None:
+            line += f', process started {self.booted:.2f} s after boot'
+        return line
+
+    def finish(self, status: str = 'Lights on') -> str:
+        self.ready = True
+        notify('READY=1', f'STATUS={status}')
+        return self.report()
+
+
+startup = StartupTimer()
@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    # Span recorder writing Chrome/Perfetto trace-event JSON, disabled unless started
+    enabled: bool = False
+    path: str = None
+    events: collections.deque = None
+
+    def __init__(self, size: int = 100000):
+        self.events = collections.deque(maxlen=size)
+        self.ids = itertools.count(1)
+        self.pid = os.getpid()
+
+    def start(self, path: str, size: int = None):
+        if size is not None:
+            self.events = collections.deque(maxlen=size)
+        self.path = path
+        self.pid = os.getpid()
+        self.enabled = True
+
+    @staticmethod
+    def now() -> int:
+        return time.perf_counter_ns() // 1000
+
+    def record(self, name: str, category: str, start: int, coroutine: bool = False):
+        # spans of coroutines interleave on the loop thread, so they become async events with their own id
+        self.events.append((name, category, start, self.now() - start, threading.get_ident(),
+                            next(self.ids) if coroutine else 0))
+
+    def span(self, name: str, category: str = 'loop'):
+        return Span(self, name, category) if self.enabled else NO_SPAN
+
+    def trace_events(self) -> list:
+        events = []
+        for name, category, start, duration, thread, span_id in list(self.events):
+            if span_id:
+                events.append({'name': name, 'cat': category, 'ph': 'b', 'ts': start, 'pid': self.pid,
+                               'tid': thread, 'id': span_id})
+                events.append({'name': name, 'cat': category, 'ph': 'e', 'ts': start + duration, 'pid': self.pid,
+                               'tid': thread, 'id': span_id})
+            else:
+                events.append({'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': duration,
+                               'pid': self.pid, 'tid': thread})
+        return events
+
+    def dump(self, path: str = None) -> str:
+        path = path or self.path
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, trace_file)
+        print(f'Trace with {len(self.events)} spans written to {path}')
+        return path
+
+
+class Span:
+    def __init__(self, tracer: Tracer, name: str, category: str):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = self.tracer.now()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer.record(self.name, self.category, self.start, True)
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NO_SPAN = NoSpan()
+tracer = Tracer()
+
+
+def traced(name: str, category: str = 'loop'):
+    # When tracing is off the wrapper costs one attribute check per call
+    def decorate(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await function(*args, **kwargs)
+                start = tracer.now()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    tracer.record(name, category, start, True)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return function(*args, **kwargs)
+                start = tracer.now()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    tracer.record(name, category, start)
+        return wrapper
+    return decorate
+
+
+def install_dump_handlers(loop: asyncio.AbstractEventLoop = None):
+    # SIGUSR1 writes the current ring buffer without stopping the process
+    import signal
+    loop = loop or asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, tracer.dump)
+    except (NotImplementedError, RuntimeError):
+        pass
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+import colorsys
+import json
+import os
+import sys
+from configparser import ConfigParser
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from led_strip.layout import LAYOUT, PixelLayout
+from led_strip.playback import ShowWriter
+
+
+def read_config(led_config: str) -> ConfigParser:
+    config = ConfigParser()
+    if not config.read(led_config):
+        raise AttributeError(f'Cannot read {led_config}')
+    return config
+
+
+def read_strips(config: ConfigParser) -> dict:
+    return {section: int(config[section]['count']) for section in config.sections() if section != LAYOUT}
+
+
+def read_layout(config: ConfigParser, strips: dict) -> PixelLayout:
+    # the layout only needs the pixel count of every strip
+    return PixelLayout.from_config(config, {name: SimpleNamespace(count=count) for name, count in strips.items()})
+
+
+def read_frames(path: str):
+    # one JSON object per line and frame: {"strip name": [[r, g, b], ...] or [0xRRGGBB, ...]}
+    with (sys.stdin if path == '-' else open(path)) as frames:
+        for line in frames:
+            if line.strip():
+                yield json.loads(line)
+
+
+def demo_frames(strips: dict, fps: float, seconds: float):
+    # a rainbow running along every strip, handy to try a setup without a rendered show
+    for index in range(int(fps * seconds)):
+        frame = {}
+        for name, count in strips.items():
+            hues = (np.arange(count) / count + index / fps / 4) % 1.0
+            frame[name] = np.array([colorsys.hsv_to_rgb(hue, 1.0, 1.0) for hue in hues]) * 255
+        yield frame
+
+
+def ring_frames(layout: PixelLayout, fps: float, seconds: float):
+    # rainbow rings running out from the middle of the shape, placed by the [layout] coordinates
+    palette = np.array([(int(r * 255) << 16) | (int(g * 255) << 8) | int(b * 255)
+                        for r, g, b in (colorsys.hsv_to_rgb(level / 256, 1.0, 1.0) for level in range(256))],
+                       dtype=np.uint32)
+    rows, columns = np.indices((layout.height, layout.width))
+    distances = np.hypot(columns - (layout.width - 1) / 2, rows - (layout.height - 1) / 2)
+    distances /= max(distances.max(), 1)
+
+    image = np.empty((layout.height, layout.width), dtype=np.uint8)
+    levels = np.empty(layout.length, dtype=np.uint8)
+    for index in range(int(fps * seconds)):
+        image[:] = (distances - index / fps / 4) % 1.0 * 255
+        layout.sample(image, levels)
+        yield layout.split(layout.render(palette, levels))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a pre-rendered light show for the video playback')
+    parser.add_argument('led_config', help='led.ini with the strips the show is rendered for')
+    parser.add_argument('output', help='show file to write')
+    parser.add_argument('--frames', help='JSON lines with one frame per line, - reads stdin')
+    parser.add_argument('--demo', type=float, metavar='SECONDS',
+                        help='write a rainbow demo show instead, in rings when the layout has coordinates')
+    parser.add_argument('--fps', type=float, default=30)
+    args = parser.parse_args()
+
+    if (args.frames is None) == (args.demo is None):
+        parser.error('Pass either --frames or --demo')
+
+    config = read_config(args.led_config)
+    strips = read_strips(config)
+    if args.frames:
+        frames = read_frames(args.frames)
+    else:
+        layout = read_layout(config, strips)
+        if layout.coordinates is not None:
+            frames = ring_frames(layout, args.fps, args.demo)
+        else:
+            frames = demo_frames(strips, args.fps, args.demo)
+    with ShowWriter(args.output, args.fps, strips) as writer:
+        for frame in frames:
+            writer.write(frame)
+
+    print(f'{args.output}: {writer.frames} frames, {writer.frames / args.fps:.1f} s at {args.fps:g} fps, '
+          f'{os.path.getsize(args.output)} bytes')
+
+
+if __name__ == '__main__':
+    main()